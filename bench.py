@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the simulator itself, on a fixed set of scenarios: swarms of
+different sizes, Seed-heavy and Seed-light swarms, and a swarm of each of
+the shipped agents.  For each scenario it reports rounds/sec,
+peers x rounds/sec, peak memory, and how the time split between the
+phases of a round (from the sim's --timing timers), and saves it all as
+JSON so runs on different commits can be compared:
+
+  bench.py --out before.json
+  ... change things ...
+  bench.py --out after.json --compare before.json
+
+Each scenario runs in a fresh process, so its peak memory is its own.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+from timeit import default_timer
+
+import sim
+
+AGENTS = ["Lfslstd", "Lfslpropshare", "Lfsltyrant", "LfslTourney", "Dummy"]
+
+# name -> (agent mix, num_pieces, blocks_per_piece, max_round)
+SCENARIOS = dict(
+    [("small-%s" % a.lower(), ("%s,8 Seed,2" % a, 16, 16, 200))
+     for a in AGENTS] +
+    [("medium-%s" % a.lower(), ("%s,40 Seed,4" % a, 64, 16, 200))
+     for a in AGENTS] +
+    [("huge-mixed", (" ".join("%s,40" % a for a in AGENTS) + " Seed,10",
+                     128, 16, 20)),
+     ("seed-heavy", ("Lfslstd,20 Seed,20", 64, 16, 200)),
+     ("seed-light", ("Lfslstd,60 Seed,1", 64, 16, 200))])
+
+# The order the scenarios are run and listed in.
+ORDER = (["small-%s" % a.lower() for a in AGENTS] +
+         ["medium-%s" % a.lower() for a in AGENTS] +
+         ["seed-heavy", "seed-light", "huge-mixed"])
+
+# The columns of the report: column -> the timing phases it adds up.
+# "other" is everything the timers don't cover.
+COLUMNS = [("requests", ["requests"]),
+           ("uploads", ["uploads"]),
+           ("checks", ["check_requests", "check_uploads"]),
+           ("transfer", ["transfer"]),
+           ("history", ["history"]),
+           ("other", [])]
+
+
+def make_config(options, name):
+    (mix, num_pieces, blocks_per_piece, max_round) = SCENARIOS[name]
+    parser = sim.make_parser("")
+    (sim_options, args) = parser.parse_args([])
+    sim_options.num_pieces = num_pieces
+    sim_options.blocks_per_piece = blocks_per_piece
+    sim_options.max_round = max_round
+    sim_options.iters = 1
+    sim_options.seed = options.seed
+    sim_options.engine = options.engine
+    sim_options.timing = True
+    sim_options.validate = options.validate
+    sim_options.model = options.model
+    return sim.make_config(sim_options, sim.parse_agents(mix.split()))
+
+
+def run_scenario(args):
+    """
+    Run one scenario once, with the agents' start-up output silenced, and
+    return its results: its size, speed, memory and time per phase.
+    args: (options, scenario name)
+    """
+    (options, name) = args
+    config = make_config(options, name)
+    s = sim.sim_class(config.model)(config)
+    (seed,) = s.iteration_seeds()
+
+    # Agents print as they start up.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = default_timer()
+        history = s.run_sim_once(seed)
+        elapsed = default_timer() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    rounds = history.last_round() + 1
+    peers = len(history.peer_ids)
+    timing = s.timers.as_dict()
+    phases = dict((phase, t["seconds"])
+                  for (phase, t) in timing["phases"].items())
+    phases["other"] = elapsed - sum(phases.values())
+    return {"scenario": name,
+            "agents": SCENARIOS[name][0],
+            "peers": peers,
+            "num_pieces": config.num_pieces,
+            "rounds": rounds,
+            "seconds": elapsed,
+            "rounds_per_sec": rounds / elapsed,
+            "peer_rounds_per_sec": peers * rounds / elapsed,
+            # Kilobytes on Linux.
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "phases": phases,
+            "agent_timing": timing["agents"]}
+
+
+def git_commit():
+    """The commit being benchmarked, or None if that can't be found."""
+    try:
+        out = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+                               stdout=subprocess.PIPE,
+                               stderr=open(os.devnull, "w"),
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = out.communicate()[0].strip()
+        return commit or None
+    except OSError:
+        return None
+
+
+def run_bench(options, names):
+    """Run each named scenario options.repeat times in a fresh process, and
+    keep the fastest run of each."""
+    # One scenario per process, so peak memory isn't shared.
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = []
+    try:
+        for name in names:
+            runs = pool.map(run_scenario, [(options, name)] * options.repeat)
+            best = min(runs, key=lambda r: r["seconds"])
+            logging.warning("%-22s %8.1f rounds/s", name,
+                            best["rounds_per_sec"])
+            results.append(best)
+    finally:
+        pool.close()
+        pool.join()
+    return {"commit": git_commit(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "engine": options.engine,
+            "validate": options.validate,
+            "model": options.model,
+            "seed": options.seed,
+            "repeat": options.repeat,
+            "results": results}
+
+
+def column_seconds(result, (column, phases)):
+    if column == "other":
+        return result["phases"]["other"]
+    return sum(result["phases"].get(p, 0.0) for p in phases)
+
+
+def report(bench, baseline=None):
+    """Print a table of bench's results, against baseline's if given."""
+    old = dict()
+    if baseline is not None:
+        old = dict((r["scenario"], r) for r in baseline["results"])
+        print "Compared with %s (%s)" % (baseline.get("commit"),
+                                         baseline.get("time"))
+    header = "%-22s %6s %7s %10s %12s %9s  %s" % (
+        "scenario", "peers", "rounds", "rounds/s", "peer-rds/s", "peak MB",
+        " ".join("%8s" % c for (c, phases) in COLUMNS))
+    if old:
+        header += "  speedup"
+    print header
+    for r in bench["results"]:
+        line = "%-22s %6d %7d %10.1f %12.1f %9.1f  %s" % (
+            r["scenario"], r["peers"], r["rounds"], r["rounds_per_sec"],
+            r["peer_rounds_per_sec"], r["peak_rss_kb"] / 1024.0,
+            " ".join("%7.0f%%" % (100 * column_seconds(r, c) / r["seconds"])
+                     for c in COLUMNS))
+        if r["scenario"] in old:
+            line += "  %6.2fx" % (r["rounds_per_sec"] /
+                                  old[r["scenario"]]["rounds_per_sec"])
+        print line
+
+
+def main(args):
+    usage_msg = "Usage:  %prog [options]"
+    parser = OptionParser(usage=usage_msg)
+
+    def usage(msg):
+        print "Error: %s\n" % msg
+        parser.print_help()
+        sys.exit()
+
+    parser.add_option("--scenarios",
+                      dest="scenarios", default=None,
+                      help="Comma separated scenarios to run, or prefixes "
+                      "like 'small' (default all): %s" % ", ".join(ORDER))
+
+    parser.add_option("--repeat",
+                      dest="repeat", default=3, type="int",
+                      help="Runs of each scenario; the fastest is kept")
+
+    parser.add_option("--engine",
+                      dest="engine", default="python",
+                      help="Simulation core: 'python' or 'numpy' (needs numpy)")
+
+    parser.add_option("--model",
+                      dest="model", default="rounds",
+                      help="Sim model: 'rounds' or 'events' (default rounds)")
+
+    parser.add_option("--validate",
+                      dest="validate", default="full",
+                      help="Checking of agents' requests and uploads: 'full', "
+                      "'sampled' or 'off' (default full)")
+
+    parser.add_option("--seed",
+                      dest="seed", default=1, type="int",
+                      help="Master random seed (default 1)")
+
+    parser.add_option("--out",
+                      dest="out", default="bench.json",
+                      help="Where to save the results (default bench.json)")
+
+    parser.add_option("--compare",
+                      dest="compare", default=None,
+                      help="Results saved by an earlier run to compare with")
+
+    (options, args) = parser.parse_args()
+
+    names = ORDER
+    if options.scenarios is not None:
+        wanted = options.scenarios.split(",")
+        names = [n for n in ORDER if any(n.startswith(w) for w in wanted)]
+        if len(names) == 0:
+            usage("No scenarios match %s" % options.scenarios)
+    if options.repeat < 1:
+        usage("--repeat must be at least 1")
+    if options.validate not in ("full", "sampled", "off"):
+        usage("Unknown validation mode: %s" % options.validate)
+    try:
+        sim.block_table_class(options.engine)
+        sim.sim_class(options.model)
+    except (ValueError, ImportError), e:
+        usage(e)
+
+    baseline = None
+    if options.compare is not None:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+    sim.configure_logging("warning")
+    bench = run_bench(options, names)
+
+    f = open(options.out, "w")
+    try:
+        json.dump(bench, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+    report(bench, baseline)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+from array import array
+
+from messages import Download
+
+
+class PieceView(object):
+    """
+    Read-only view of one peer's row of a BlockTable: how many blocks of
+    each piece the peer has.  Indexes, iterates and len()s like the list
+    agents used to get, but shares storage with the sim instead of copying.
+    """
+    __slots__ = ('_row',)
+
+    def __init__(self, row):
+        self._row = row
+
+    def __getitem__(self, i):
+        return self._row[i]
+
+    def __getslice__(self, i, j):
+        return list(self._row[i:j])
+
+    def __len__(self):
+        return len(self._row)
+
+    def __iter__(self):
+        return iter(self._row)
+
+    def __repr__(self):
+        return repr(list(self._row))
+
+
+class BlockTable:
+    """
+    The number of blocks of each piece that each peer has.  One compact
+    array per peer, updated in place with each round's downloads.  Stored
+    as doubles, since agents are free to upload fractional bandwidth.
+
+    table[peer_id] is the peer's mutable row, for the sim's own use.
+    table.view(peer_id) is the read-only view handed to the peer.
+
+    This is the sim's plain-python engine.  NumpyBlockTable in npblocks.py
+    has the same interface.
+    """
+    def __init__(self, blocks_per_piece, rows):
+        """
+        rows: dict : peer_id -> [blocks of each piece]
+        """
+        self.blocks_per_piece = blocks_per_piece
+        self.rows = dict((pid, array('d', r)) for (pid, r) in rows.items())
+        self.views = dict((pid, PieceView(row))
+                          for (pid, row) in self.rows.items())
+
+        # The rarity index: how many peers have each piece.
+        num_pieces = len(rows.values()[0]) if rows else 0
+        self.counts = array('i', [0] * num_pieces)
+        for row in self.rows.values():
+            for (i, b) in enumerate(row):
+                if b == blocks_per_piece:
+                    self.counts[i] += 1
+        self.counts_view = PieceView(self.counts)
+
+        # Completion is tracked incrementally: the number of pieces each
+        # peer is still missing, the number of peers that aren't done, and
+        # the peers that finished since the last take_newly_done().
+        self.missing = dict(
+            (pid, sum(1 for b in row if b != blocks_per_piece))
+            for (pid, row) in self.rows.items())
+        self.not_done = sum(1 for m in self.missing.values() if m > 0)
+        self.newly_done = [pid for (pid, m) in self.missing.items() if m == 0]
+
+    def __getitem__(self, peer_id):
+        return self.rows[peer_id]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def view(self, peer_id):
+        return self.views[peer_id]
+
+    def piece_counts(self):
+        """Read-only view of the rarity index: peers having each piece."""
+        return self.counts_view
+
+    def uncount(self, pieces):
+        """
+        Take one holder off the rarity index for each of pieces: for a
+        peer that holds them only as placeholders (see --files).
+        """
+        for i in pieces:
+            self.counts[i] -= 1
+
+    def add_blocks(self, peer_id, piece_id, blocks):
+        """
+        Give peer_id blocks more blocks of piece_id.  Returns True if that
+        completed the piece.
+        """
+        row = self.rows[peer_id]
+        row[piece_id] += blocks
+        if row[piece_id] != self.blocks_per_piece:
+            return False
+        self.counts[piece_id] += 1
+        self.missing[peer_id] -= 1
+        if self.missing[peer_id] == 0:
+            self.not_done -= 1
+            self.newly_done.append(peer_id)
+        return True
+
+    def transfer(self, requests, uploads):
+        """
+        Process the uploads: figure out how many blocks of all the requested
+        pieces the requesters ended up with, and add them to the table.
+        Make sure requesting the same thing from lots of peers doesn't
+        stack.
+
+        requests: dict : peer_id -> [requests made by that peer]
+        uploads: dict : peer_id -> [uploads made by that peer]
+
+        Returns (downloads, completed)
+        downloads: dict : peer_id -> [downloads to that peer]
+        completed: [(peer_id, piece_id)] for each piece finished this round
+        """
+        bpp = self.blocks_per_piece
+
+        # (uploader, requester) -> bw, built once for the round, and the
+        # uploaders giving each requester anything.  Only the first upload
+        # to a requester counts.
+        rate = dict()
+        granted = dict()  # requester -> set(uploaders)
+        for (uploader_id, us) in uploads.iteritems():
+            for u in us:
+                key = (uploader_id, u.to_id)
+                if key not in rate:
+                    rate[key] = u.bw
+                    if u.bw != 0:
+                        granted.setdefault(u.to_id, set()).add(uploader_id)
+
+        downloads = dict((requester_id, []) for requester_id in requests)
+        completed = []
+        get_peer_id = lambda r: r.peer_id
+        # Most requesters get nothing from most of the peers they ask, so
+        # only the requests to peers that upload to them are looked at.
+        for requester_id in requests:
+            uploaders = granted.get(requester_id)
+            if uploaders is None:
+                continue
+            rs = [r for r in requests[requester_id] if r.peer_id in uploaders]
+            # Each uploader's bandwidth is applied in order to the requests
+            # to it, grouped by uploader.  Keep the biggest transfer of each
+            # piece: piece -> (blocks, from_who)
+            best = dict()
+            left = dict()  # uploader -> bw still to give
+            for r in sorted(rs, key=get_peer_id):
+                peer_id = r.peer_id
+                bw = left.get(peer_id)
+                if bw is None:
+                    bw = rate[(peer_id, requester_id)]
+                if bw == 0:
+                    continue
+                blocks = min(bw, bpp - r.start)
+                left[peer_id] = bw - blocks
+                old = best.get(r.piece_id)
+                if old is None or blocks > old[0]:
+                    best[r.piece_id] = (blocks, peer_id)
+
+            for piece_id in best:
+                if self.add_blocks(requester_id, piece_id, best[piece_id][0]):
+                    completed.append((requester_id, piece_id))
+            downloads[requester_id] = [
+                Download(peer_id, requester_id, piece_id, blocks)
+                for (piece_id, (blocks, peer_id)) in best.iteritems()]
+
+        return (downloads, completed)
+
+    def take_newly_done(self):
+        """
+        Return the ids of the peers that got their last piece since the
+        last call (or that started with every piece), and forget them.
+        """
+        done = self.newly_done
+        self.newly_done = []
+        return done
+
+    def is_done(self, peer_id):
+        """True if peer_id has every piece (placeholders included)."""
+        return self.missing[peer_id] == 0
+
+    def all_done(self):
+        return self.not_done == 0
@@ -6,7 +6,6 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 
 from messages import Upload, Request
@@ -14,6 +13,10 @@ from util import even_split
 from peer import Peer
 
 class Dummy(Peer):
+    # Dummy never looks at self.piece_counts, so the sim needn't keep them.
+    # Take this out if your agent does.
+    reads_piece_counts = False
+
     def post_init(self):
         print "post_init(): %s here!" % self.id
         self.dummy_state = dict()
@@ -33,20 +36,21 @@ class Dummy(Peer):
         np_set = set(needed_pieces)  # sets support fast intersection ops.
 
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, needed_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, needed_pieces)
 
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.info("id: %s, available pieces: %s" % (p.id, set(p.available_pieces).intersection(needed_pieces)))
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            for p in peers:
+                logging.info("id: %s, available pieces: %s", p.id,
+                             set(p.available_pieces).intersection(needed_pieces))
 
         logging.debug("And look, I have my entire history available too:")
         logging.debug("look at the AgentHistory class in history.py for details")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []   # We'll put all the things we want here
         # Symmetry breaking is good...
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
         # Sort peers by id.  This is probably not a useful sort, but other
         # sorts might be useful
@@ -60,7 +64,7 @@ class Dummy(Peer):
             # More symmetry breaking -- ask for random pieces.
             # This would be the place to try fancier piece-requesting strategies
             # to avoid getting the same thing from multiple peers at a time.
-            for piece_id in random.sample(isect, n):
+            for piece_id in self.rng.sample(isect, n):
                 # aha! The peer has this piece! Request it.
                 # which part of the piece do we need next?
                 # (must get the next-needed blocks in order)
@@ -82,8 +86,7 @@ class Dummy(Peer):
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
@@ -98,7 +101,7 @@ class Dummy(Peer):
             # change my internal state for no reason
             self.dummy_state["cake"] = "pie"
 
-            request = random.choice(requests)
+            request = self.rng.choice(requests)
             chosen = [request.requester_id]
             # Evenly "split" my upload bandwidth among the one chosen requester
             bws = even_split(self.up_bw, len(chosen))
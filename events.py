@@ -0,0 +1,287 @@
+#!/usr/bin/python
+
+"""
+Event-driven model for the sim, selected with --model events.  Instead of
+every peer acting in lock-step, each peer acts on its own schedule, and
+requests and uploads take time to get where they're going:
+
+  - Each peer has its own round length (its period), drawn from
+    1 +/- --period-spread, and a random start within its first period.
+    Every period it makes requests and decides its uploads, through the
+    usual Peer.requests and Peer.uploads.
+  - Each link has a latency, drawn from 0 to --max-latency.  A request
+    reaches the peer asked after the link's latency, and waits in that
+    peer's inbox for its next turn.
+  - An upload sends a period's worth of bandwidth.  The blocks arrive when
+    the period is over, plus the link's latency, and count if the
+    requester still needs them.
+  - A peer that has every piece and no requests waiting goes to sleep,
+    and is woken by the next request to reach it, instead of being polled.
+
+The events sit in a priority queue ordered by time.  Time is measured in
+rounds, and the sim's History is still kept by round: round r holds
+everything that happened from time r to r + 1, so stats and traces work
+as in the lock-step model.
+
+Agents are written for rounds, so each one sees its own turns as its
+rounds: the AgentHistory it's given has one round per turn it has taken,
+holding the downloads that reached it and the uploads it made during that
+turn.  Agents run unchanged on either model.
+"""
+
+import heapq
+import logging
+import random
+
+from history import AgentHistory
+from messages import Download
+from sim import Sim, SimState
+from util import derive_seed
+
+# Event kinds
+TICK = 0      # (peer_id,): the peer takes its turn
+ARRIVE = 1    # (request,): a request reaches the peer asked
+DELIVER = 2   # (from_id, to_id, piece, blocks): an upload's blocks arrive
+
+
+class EventState(SimState):
+    """
+    SimState plus the event queue.
+    queue: heap of (time, seq, kind, args).  seq breaks ties in the order
+           the events were added, so runs are reproducible.
+    periods: dict : peer_id -> round length
+    latencies: dict : (peer_id, peer_id) -> latency, filled in as needed
+    inbox: dict : peer_id -> [requests that reached the peer since its
+           last turn]
+    asleep: set of peer ids with nothing to do until a request comes in
+    unstarted: set of peer ids that haven't had their first turn yet
+    in_flight: number of DELIVER events in the queue
+    downloads, uploads: dict : peer_id -> [messages] for the current round
+    agent_histories: dict : peer_id -> the peer's AgentHistory, by turn
+    turn_downloads, turn_uploads: dict : peer_id -> [messages] since the
+           peer's last turn, for its next round of agent history
+    """
+    def __init__(self, config, seed, peers, peer_pieces, up_bws, history,
+                 files=None):
+        SimState.__init__(self, config, seed, peers, peer_pieces, up_bws,
+                          history, files)
+        self.queue = []
+        self.seq = 0
+        self.periods = dict()
+        self.latencies = dict()
+        self.inbox = dict((pid, []) for pid in self.peer_ids)
+        self.asleep = set()
+        self.unstarted = set(self.peer_ids)
+        self.in_flight = 0
+        self.check = ()
+        self.new_round()
+        window = config.history_window
+        self.agent_histories = dict(
+            (pid, AgentHistory(pid, PeerRounds(window), PeerRounds(window)))
+            for pid in self.peer_ids)
+        self.turn_downloads = dict((pid, []) for pid in self.peer_ids)
+        self.turn_uploads = dict()  # no entry before the first turn
+        for pid in self.peer_ids:
+            rng = random.Random(derive_seed(seed, "period", pid))
+            spread = config.period_spread
+            self.periods[pid] = rng.uniform(1 - spread, 1 + spread)
+            self.push(rng.uniform(0, self.periods[pid]), TICK, (pid,))
+
+    def push(self, time, kind, args):
+        heapq.heappush(self.queue, (time, self.seq, kind, args))
+        self.seq += 1
+
+    def new_round(self):
+        self.downloads = dict((pid, []) for pid in self.peer_ids)
+        self.uploads = dict((pid, []) for pid in self.peer_ids)
+
+    def latency(self, a, b):
+        """The latency of the link between peers a and b, both ways."""
+        key = (min(a, b), max(a, b))
+        if key not in self.latencies:
+            rng = random.Random(derive_seed(self.seed, "latency", *key))
+            self.latencies[key] = rng.uniform(0, self.config.max_latency)
+        return self.latencies[key]
+
+
+class EventSim(Sim):
+    """
+    The event-driven model.  Runs a round at a time like Sim, so logging,
+    checkpoints, stop reasons and the rest work the same way, but within a
+    round it just works through the events that fall in it.
+    """
+    state_class = EventState
+
+    def run_round(self, state):
+        """
+        Handle the events in round state.round, and move state on to the
+        next one.
+
+        Blocks only arrive a period and a latency after they're sent, so a
+        round with no downloads isn't counted as stalled for --stall-rounds
+        while any are on their way, or while some peer hasn't had its first
+        turn.  Even with --stall-rounds 1 a healthy swarm runs to the end:
+        >>> from sim import make_parser, make_config, parse_agents
+        >>> (options, args) = make_parser("").parse_args(
+        ...     "--model events --stall-rounds 1 Dummy,4 Seed,2".split())
+        >>> sim = EventSim(make_config(options, parse_agents(args)))
+        >>> runs = [sim.run_sim_once(seed)
+        ...         for seed in range(3)]  # doctest: +ELLIPSIS
+        post_init(): Dummy0 here!
+        ...
+        >>> [h.stop_reason for h in runs]
+        ['done', 'done', 'done']
+        """
+        logging.info("======= Round %d ========", state.round)
+        t = self.timers
+        if t: mark = t.now()
+        self.refresh_neighbors(state)
+        state.check = self.peers_to_check(state)
+        if t: t.lap("peer_info", mark)
+        end = state.round + 1
+        queue = state.queue
+        while queue and queue[0][0] < end:
+            (time, seq, kind, args) = heapq.heappop(queue)
+            if kind == TICK:
+                self.tick(state, time, *args)
+            elif kind == ARRIVE:
+                if t: mark = t.now()
+                self.arrive(state, time, *args)
+                if t: t.lap("route", mark)
+            else:
+                if t: mark = t.now()
+                self.deliver(state, time, *args)
+                if t: t.lap("transfer", mark)
+
+        (downloads, uploads) = (state.downloads, state.uploads)
+        busy = state.in_flight > 0 or state.unstarted
+        self.count_progress(state, busy or any(downloads.itervalues()))
+        state.new_round()
+        self.end_round(state, downloads, uploads)
+
+    def tick(self, state, time, pid):
+        """Peer pid's turn: make its requests and decide its uploads.  With
+        --timing, its phases are timed under the lock-step model's names:
+        sending requests on their way is routing, and working out what
+        its uploads send is transfer."""
+        t = self.timers
+        if t: mark = t.now()
+        p = state.peers_by_id[pid]
+        inbox = state.inbox[pid]
+        state.unstarted.discard(pid)
+        if not inbox and state.peer_pieces.is_done(pid):
+            state.asleep.add(pid)
+            if t: t.lap("peer_info", mark)
+            return
+
+        # The turn before this one becomes the peer's last round.
+        h = state.agent_histories[pid]
+        if pid in state.turn_uploads:
+            h.downloads.append(state.turn_downloads[pid])
+            h.uploads.append(state.turn_uploads[pid])
+            state.turn_downloads[pid] = []
+
+        swarm = self.swarm(state)
+        check = pid in state.check
+        if t: t.lap("peer_info", mark)
+        rs = self.get_peer_requests(state, p, swarm, h, check)
+        if t: mark = t.now()
+        for r in rs:
+            state.push(time + state.latency(pid, r.peer_id), ARRIVE, (r,))
+        if t: t.lap("route", mark)
+
+        state.inbox[pid] = []
+        period = state.periods[pid]
+        us = self.get_peer_uploads(state, inbox, p, swarm, h, check)
+        if t: mark = t.now()
+        state.uploads[pid].extend(us)
+        state.turn_uploads[pid] = us
+        self.send(state, time + period, pid, inbox, us)
+        state.push(time + period, TICK, (pid,))
+        if t: t.lap("transfer", mark)
+
+    def send(self, state, time, pid, requests, uploads):
+        """
+        Start the uploads peer pid decided on at the end of its period,
+        time.  As in the lock-step model, each upload's bandwidth goes to
+        the requester's requests to pid in order, and only the first upload
+        to a requester counts.
+        """
+        bpp = self.config.blocks_per_piece
+        rate = dict()
+        for u in uploads:
+            rate.setdefault(u.to_id, u.bw)
+        for r in requests:
+            bw = rate.get(r.requester_id, 0)
+            if bw <= 0:
+                continue
+            blocks = min(bw, bpp - r.start)
+            rate[r.requester_id] = bw - blocks
+            arrival = time + state.latency(pid, r.requester_id)
+            state.push(arrival, DELIVER,
+                       (pid, r.requester_id, r.piece_id, blocks))
+            state.in_flight += 1
+
+    def arrive(self, state, time, request):
+        """A request reaches the peer it asks, which wakes up if asleep."""
+        pid = request.peer_id
+        state.inbox[pid].append(request)
+        if pid in state.asleep:
+            state.asleep.discard(pid)
+            state.push(time, TICK, (pid,))
+
+    def deliver(self, state, time, from_id, to_id, piece, blocks):
+        """An upload's blocks arrive.  Anything the requester got from
+        somewhere else in the meantime doesn't count twice."""
+        state.in_flight -= 1
+        table = state.peer_pieces
+        needed = self.config.blocks_per_piece - table[to_id][piece]
+        if needed <= 0:
+            return
+        blocks = min(blocks, needed)
+        if table.add_blocks(to_id, piece, blocks):
+            self.add_available(state, [(to_id, piece)])
+        d = Download(from_id, to_id, piece, blocks)
+        state.downloads[to_id].append(d)
+        state.turn_downloads[to_id].append(d)
+
+
+class PeerRounds(object):
+    """
+    One peer's rounds of messages, as the list AgentHistory expects: one
+    list per round, appended a round at a time.  With a window, only the
+    last window rounds can be read back, as with History.
+    """
+    __slots__ = ('rounds', 'first', 'window')
+
+    def __init__(self, window=None):
+        self.rounds = []
+        self.first = 0  # rounds before this have been dropped
+        self.window = window
+
+    def append(self, messages):
+        self.rounds.append(messages)
+        if self.window is not None and len(self.rounds) >= 2 * self.window:
+            drop = len(self.rounds) - self.window
+            del self.rounds[:drop]
+            self.first += drop
+
+    def __len__(self):
+        return self.first + len(self.rounds)
+
+    def __getitem__(self, r):
+        n = len(self)
+        if isinstance(r, slice):
+            return [self[i] for i in xrange(*r.indices(n))]
+        if r < 0:
+            r += n
+        if r < self.first or r >= n:
+            raise IndexError("round index out of range")
+        return self.rounds[r - self.first]
+
+    def __iter__(self):
+        return iter(self.rounds)
+
+    def __repr__(self):
+        return repr(self.rounds)
+
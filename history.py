@@ -2,6 +2,15 @@
 
 import copy
 import pprint
+from array import array
+from itertools import izip
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from messages import Download, Upload
 
 
 class AgentHistory:
@@ -10,7 +19,7 @@ class AgentHistory:
 
     history.downloads: [[Download objects for round]]  (one sublist for each round)
          All the downloads _to_ this agent.
-        
+
     history.uploads: [[Upload objects for round]]  (one sublist for each round)
          All the downloads _from_ this agent.
 
@@ -36,24 +45,223 @@ class AgentHistory:
             pprint.pformat(self.uploads))
 
 
+class MessageLog:
+    """
+    Append-only, columnar storage for one kind of message (Downloads or
+    Uploads).  Each message attribute is a column: peer ids are stored as
+    indexes into ids, everything else as numbers.  The arrays grow in
+    place, so adding a round never copies the ones before it.
+
+    Messages are appended one (round, peer) run at a time, in the same peer
+    order every round.  offsets[(r - first_round) * num_peers + i] is where
+    the run for round r and the i'th peer starts.
+
+    With a window of K rounds, only the last K rounds can be read back.
+    Older rounds are dropped in batches once 2K are held, so memory stays
+    flat however long the sim runs; their sums are kept for sum_by.
+    """
+    def __init__(self, message_class, columns, ids, window=None):
+        """
+        message_class: built with the column values, in order
+        columns: [(attribute, array typecode)].  Attributes ending in _id
+                 hold peer ids.
+        ids: the peer ids, in the order they're appended each round
+        window: number of rounds to keep, or None to keep them all
+        """
+        self.message_class = message_class
+        self.attrs = [attr for (attr, typecode) in columns]
+        self.columns = dict((attr, array(typecode))
+                            for (attr, typecode) in columns)
+        self.num_peers = len(ids)
+        self.ids = ids[:]
+        self.index = dict((pid, i) for (i, pid) in enumerate(ids))
+        self.offsets = array('l', [0])
+        if window is not None and window < 1:
+            raise ValueError("History window must be at least 1 round")
+        self.window = window
+        self.first_round = 0  # rounds before this have been dropped
+        self.dropped_sums = dict()  # (key, value) -> sums of dropped rows
+
+    def id_index(self, pid):
+        if pid not in self.index:
+            self.index[pid] = len(self.ids)
+            self.ids.append(pid)
+        return self.index[pid]
+
+    def append(self, messages):
+        """Add the next (round, peer) run of messages."""
+        for attr in self.attrs:
+            col = self.columns[attr]
+            if attr.endswith("_id"):
+                col.extend(self.id_index(getattr(m, attr)) for m in messages)
+            else:
+                col.extend(getattr(m, attr) for m in messages)
+        self.offsets.append(self.offsets[-1] + len(messages))
+        if (self.window is not None and
+            len(self.offsets) - 1 >= 2 * self.window * self.num_peers):
+            self.drop_rounds(self.rounds() - self.window - self.first_round)
+
+    def drop_rounds(self, d):
+        """Forget the oldest d rounds held."""
+        n = d * self.num_peers
+        cut = self.offsets[n]
+        for key in self.attrs:
+            if not key.endswith("_id"):
+                continue
+            for value in self.attrs:
+                if self.columns[value].typecode != 'd':
+                    continue
+                old = self.dropped_sums.get((key, value), dict())
+                sums = self.sum_rows(key, value, cut)
+                self.dropped_sums[(key, value)] = dict(
+                    (pid, old.get(pid, 0) + s) for (pid, s) in sums.items())
+        for col in self.columns.values():
+            del col[:cut]
+        self.offsets = array('l', (o - cut for o in self.offsets[n:]))
+        self.first_round += d
+
+    def rounds(self):
+        """Number of rounds appended so far, including dropped ones."""
+        return self.first_round + (len(self.offsets) - 1) / self.num_peers
+
+    def first_visible(self):
+        """The oldest round that can still be read."""
+        if self.window is None:
+            return self.first_round
+        return max(self.first_round, self.rounds() - self.window)
+
+    def messages(self, r, i):
+        """Return the messages for round r and the i'th peer, as objects."""
+        if r < self.first_visible():
+            raise IndexError("round %d is outside the history window" % r)
+        k = (r - self.first_round) * self.num_peers + i
+        rng = xrange(self.offsets[k], self.offsets[k+1])
+        cols = []
+        for attr in self.attrs:
+            col = self.columns[attr]
+            if attr.endswith("_id"):
+                cols.append([self.ids[col[j]] for j in rng])
+            else:
+                cols.append([col[j] for j in rng])
+        return [self.message_class(*vals) for vals in izip(*cols)]
+
+    def sum_by(self, key, value):
+        """
+        Group by the key column and sum the value column, over every round
+        including dropped ones.  Returns dict : peer_id -> sum, for every
+        known peer id.
+        """
+        sums = self.sum_rows(key, value, len(self.columns[key]))
+        for (pid, s) in self.dropped_sums.get((key, value), dict()).items():
+            sums[pid] += s
+        return sums
+
+    def sum_rows(self, key, value, end):
+        """sum_by over the first end rows held."""
+        keys = self.columns[key]
+        values = self.columns[value]
+        if np is not None and end > 0:
+            sums = np.bincount(
+                np.frombuffer(keys, dtype=keys.typecode)[:end],
+                weights=np.frombuffer(values, dtype=values.typecode)[:end],
+                minlength=len(self.ids)).tolist()
+        else:
+            sums = [0] * len(self.ids)
+            for j in xrange(end):
+                sums[keys[j]] += values[j]
+        return dict(izip(self.ids, sums))
+
+
+class RoundsView(object):
+    """
+    One peer's part of a MessageLog as a read-only sequence, one list of
+    messages per round -- what History.downloads[peer_id] used to be.
+    Message objects are only built for the rounds that get looked at.
+
+    len() counts every round so far, so AgentHistory.current_round() stays
+    right with a history window.  Rounds before the window raise
+    IndexError, and iterating only goes over the rounds in the window.
+    """
+    __slots__ = ('log', 'peer')
+
+    def __init__(self, log, peer):
+        self.log = log
+        self.peer = peer  # index into log.ids
+
+    def __len__(self):
+        return self.log.rounds()
+
+    def __getitem__(self, r):
+        n = len(self)
+        if isinstance(r, slice):
+            return [self[i] for i in xrange(*r.indices(n))]
+        if r < 0:
+            r += n
+        if r < 0 or r >= n:
+            raise IndexError("round index out of range")
+        return self.log.messages(r, self.peer)
+
+    def __iter__(self):
+        for r in xrange(self.log.first_visible(), len(self)):
+            yield self[r]
+
+    def __repr__(self):
+        first = self.log.first_visible()
+        if first == 0:
+            return repr(list(self))
+        return "[<rounds 0-%d dropped>, %s" % (first - 1, repr(list(self))[1:])
+
+
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, window=None, sink=None,
+                 file_pieces=None):
         """
         uploads:
                    dict : peer_id -> [[uploads] -- one list per round]
         downloads:
                    dict : peer_id -> [[downloads] -- one list per round]
-                   
+
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
+
+        Both are read-only views over the columnar download_log and
+        upload_log.  If window is given, only the last window rounds can be
+        read back from them.
+
+        sink: an optional tracefile.HistorySink that gets everything
+        recorded, as it's recorded.  close() closes it.
+
+        file_pieces: with --files, the pieces in each file.  Then the
+        history also keeps per-file totals:
+        file_done: dict : (peer_id, file) -> round the peer finished it
+        file_uploaded: dict : (peer_id, file) -> blocks of it uploaded
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
         self.peer_ids = peer_ids[:]
 
         self.round_done = dict()   # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        self.file_pieces = file_pieces
+        self.file_done = dict()
+        self.file_uploaded = dict()
+        # The last round run, and why the sim stopped there: "done",
+        # "out_of_time", or "no_downloads" (a stall).
+        self.stop_round = None
+        self.stop_reason = None
+        self.download_log = MessageLog(
+            Download,
+            [("from_id", 'i'), ("to_id", 'i'), ("piece", 'i'), ("blocks", 'd')],
+            self.peer_ids, window)
+        self.upload_log = MessageLog(
+            Upload, [("from_id", 'i'), ("to_id", 'i'), ("bw", 'd')],
+            self.peer_ids, window)
+        self.downloads = dict((pid, RoundsView(self.download_log, i))
+                              for (i, pid) in enumerate(self.peer_ids))
+        self.uploads = dict((pid, RoundsView(self.upload_log, i))
+                            for (i, pid) in enumerate(self.peer_ids))
+        self.sink = sink
+        if sink is not None:
+            sink.start(self.peer_ids, upload_rates, file_pieces)
 
     def update(self, dls, ups):
         """
@@ -62,37 +270,73 @@ class History:
 
         append these downloads to to the history
         """
+        if self.sink is not None:
+            self.sink.write_round(self.last_round()+1, dls, ups)
         for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+            self.download_log.append(dls[pid])
+            self.upload_log.append(ups[pid])
+        n = self.file_pieces
+        if n is not None:
+            totals = self.file_uploaded
+            for ds in dls.itervalues():
+                for d in ds:
+                    key = (d.from_id, d.piece // n)
+                    totals[key] = totals.get(key, 0) + d.blocks
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
         if peer_id not in self.round_done:
             self.round_done[peer_id] = round
+            if self.sink is not None:
+                self.sink.write_done(peer_id, round)
+
+    def peer_finished_file(self, round, peer_id, file):
+        if (peer_id, file) not in self.file_done:
+            self.file_done[(peer_id, file)] = round
+            if self.sink is not None:
+                self.sink.write_file_done(peer_id, file, round)
+
+    def stopped(self, round, reason):
+        self.stop_round = round
+        self.stop_reason = reason
+        if self.sink is not None:
+            self.sink.write_stop(round, reason)
+
+    def close(self):
+        """Close the sink, if any.  Nothing more can be recorded after."""
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
 
     def peer_history(self, peer_id):
         return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p])-1
+        return self.download_log.rounds()-1
+
+    def first_round(self):
+        """index of the oldest round still in the history window"""
+        return self.download_log.first_visible()
 
     def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
+        lines = ["\nRound %s:\n" % r]
         for peer_id in self.peer_ids:
             ds = self.downloads[peer_id][r]
             stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
                 peer_id, d.blocks, d.piece, d.from_id)
-            s += "".join(map(stringify, ds))
-        return s
+            lines.extend(map(stringify, ds))
+        return "".join(lines)
 
     def pretty(self):
-        s = "History\n"
-        for r in range(self.last_round()+1):
-            s += self.pretty_for_round(r)
-        return s
+        # Join once at the end: building this up with += is quadratic.
+        parts = ["History\n"]
+        if self.first_round() > 0:
+            parts.append("(rounds before %d are outside the history window)\n"
+                         % self.first_round())
+        for r in range(self.first_round(), self.last_round()+1):
+            parts.append(self.pretty_for_round(r))
+        return "".join(parts)
 
     def __repr__(self):
         return """History(
@@ -101,4 +345,3 @@ downloads=%s
 )""" % (
     pprint.pformat(self.uploads),
     pprint.pformat(self.downloads))
-
@@ -8,12 +8,12 @@ share of its bandwidth for optimistic unchoking (e.g., 10%). For example
 
 """
 
-import random
 import logging
 
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
+from piecebits import PieceBits
 
 class Lfslpropshare(Peer):
     def post_init(self):
@@ -34,41 +34,36 @@ class Lfslpropshare(Peer):
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
         needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)  # sets support fast intersection ops.
-        piecedict = {}
-        for piece in needed_pieces:
-            numhaving = 0
-            for peer in peers:
-                if piece in peer.available_pieces:
-                    numhaving += 1
-            piecedict[piece] = numhaving
+        np_bits = PieceBits.from_pieces(needed_pieces)  # fast intersection
+        # number of peers that have each piece, kept up to date by the sim
+        piecedict = self.piece_counts
 
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, needed_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, needed_pieces)
 
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id,
+                              p.available_pieces)
 
         logging.debug("And look, I have my entire history available too:")
         logging.debug("look at the AgentHistory class in history.py for details")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []   # We'll put all the things we want here
         # Symmetry breaking is good...
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
         # Sort peers by id.  This is probably not a useful sort, but other
         # sorts might be useful
-        random.shuffle(peers)
+        self.rng.shuffle(peers)
         # request all available pieces from all peers!
         # (up to self.max_requests from each)
         round = history.current_round()
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
-            if isect == set():
+            isect = peer.available_bits & np_bits
+            if not isect:
                 continue
             n = min(self.max_requests, len(isect))
             # More symmetry breaking -- ask for random pieces.
@@ -84,7 +79,7 @@ class Lfslpropshare(Peer):
                     r = Request(self.id, peer.id, piece_id, start_block)
                     requests.append(r)
             else:
-                for piece_id in random.sample(isect, n):
+                for piece_id in self.rng.sample(list(isect), n):
                     # aha! The peer has this piece! Request it.
                     # which part of the piece do we need next?
                     # (must get the next-needed blocks in order)
@@ -106,8 +101,7 @@ class Lfslpropshare(Peer):
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
@@ -142,12 +136,12 @@ class Lfslpropshare(Peer):
                 #now actually find the proportionality
                 try:
                     bws = [int(self.up_bw*self.for_sharing*(float(ndict.get(id, 0))/float(totaluploads))) for id in requestids]
-                    randind = random.randint(0, len(requestids) - 1)
+                    randind = self.rng.randint(0, len(requestids) - 1)
 
                     to_share = min(self.up_bw - sum(bws), self.up_bw*self.for_sharing)
                     #the rest of our bandwidth goes towards optimistic unchoking
                     bws[randind] += int(to_share)
-                    logging.debug((str(self.id) + " " + str(self.up_bw) + ": " + str(zip(requestids,bws))))
+                    logging.debug("%s %s: %s", self.id, self.up_bw, zip(requestids, bws))
                     chosen = requestids
                 except:
                     chosen = [request.requester_id for request in requests][:4]
@@ -2,12 +2,12 @@
 
 """including rarest first, recipocation and optimistic unchoking."""
 
-import random
 import logging
 
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
+from piecebits import PieceBits
 
 class Lfslstd(Peer):
     def post_init(self):
@@ -26,43 +26,37 @@ class Lfslstd(Peer):
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
         needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)  # sets support fast intersection ops.
+        np_bits = PieceBits.from_pieces(needed_pieces)  # fast intersection
 
-        # count number of peers that have each needed piece
-        piecedict = {}
-        for piece in needed_pieces:
-            numhaving = 0
-            for peer in peers:
-                if piece in peer.available_pieces:
-                    numhaving += 1
-            piecedict[piece] = numhaving
+        # number of peers that have each piece, kept up to date by the sim
+        piecedict = self.piece_counts
 
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, needed_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, needed_pieces)
 
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id,
+                              p.available_pieces)
 
         logging.debug("And look, I have my entire history available too:")
         logging.debug("look at the AgentHistory class in history.py for details")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []   # We'll put all the things we want here
         # Symmetry breaking is good...
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
         # Sort peers by id.  This is probably not a useful sort, but other
         # sorts might be useful
-        random.shuffle(peers)
+        self.rng.shuffle(peers)
         # request all available pieces from all peers!
         # (up to self.max_requests from each)
         round = history.current_round()
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
-            if isect == set():
+            isect = peer.available_bits & np_bits
+            if not isect:
                 continue
             n = min(self.max_requests, len(isect))
             # More symmetry breaking -- ask for random pieces.
@@ -81,7 +75,7 @@ class Lfslstd(Peer):
                     r = Request(self.id, peer.id, piece_id, start_block)
                     requests.append(r)
             else:
-                for piece_id in random.sample(isect, n):
+                for piece_id in self.rng.sample(list(isect), n):
                     # aha! The peer has this piece! Request it.
                     # which part of the piece do we need next?
                     # (must get the next-needed blocks in order)
@@ -103,8 +97,7 @@ class Lfslstd(Peer):
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
@@ -120,13 +113,13 @@ class Lfslstd(Peer):
             # on first round, evenly split bandwidth speed between 4 random requesters
             self.dummy_state["cake"] = "pie"
             if round == 0:
-                random.shuffle(requests)
+                self.rng.shuffle(requests)
                 chosen = [request.requester_id for request in requests[0:4]]
                 bws = even_split(self.up_bw, len(chosen))
             else:
                 # optimistic unchoking every 3 periods
                 if "unchoked_agent" not in self.dummy_state or round % 3 == 1:
-                    self.dummy_state["unchoked_agent"] = random.choice(peers).id
+                    self.dummy_state["unchoked_agent"] = self.rng.choice(peers).id
                 ndict = {}
                 for i in range(1, min(round, 4)):
                     pasthist = history.downloads[round-i]
@@ -144,7 +137,7 @@ class Lfslstd(Peer):
                 top = sorted(ndict.items(), key = lambda x: x[1], reverse=True)
 
                 reqset = set(request.requester_id for request in requests)
-                logging.debug(repr(top))
+                logging.debug("%r", top)
                 # get 3 most generous bots
                 top3 = []
                 for id in top:
@@ -6,12 +6,12 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
+from piecebits import PieceBits
 
 class LfslTourney(Peer):
     # constants for how fast we update our beliefs about upload and download speeds
@@ -42,44 +42,40 @@ class LfslTourney(Peer):
         """
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
         needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)  # sets support fast intersection ops.
+        np_bits = PieceBits.from_pieces(needed_pieces)  # fast intersection
 
-        # count number of peers that have each needed piece
-        piecedict = {}
-        for piece in needed_pieces:
-            numhaving = 0
-            for peer in peers:
-                if piece in peer.available_pieces:
-                    numhaving += 1
-            piecedict[piece] = numhaving
+        # number of peers that have each piece, kept up to date by the sim
+        piecedict = self.piece_counts
 
-        logging.debug("%s here: still need pieces %s" % (
-            self.id, needed_pieces))
+        logging.debug("%s here: still need pieces %s", self.id, needed_pieces)
 
-        logging.debug("%s still here. Here are some peers:" % self.id)
-        for p in peers:
-            logging.debug("id: %s, available pieces: %s" % (p.id, p.available_pieces))
+        logging.debug("%s still here. Here are some peers:", self.id)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for p in peers:
+                logging.debug("id: %s, available pieces: %s", p.id,
+                              p.available_pieces)
 
         logging.debug("And look, I have my entire history available too:")
         logging.debug("look at the AgentHistory class in history.py for details")
-        logging.debug(str(history))
+        logging.debug("%s", history)
 
         requests = []   # We'll put all the things we want here
         # Symmetry breaking is good...
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
         # Sort peers by id.  This is probably not a useful sort, but other
         # sorts might be useful
-        random.shuffle(peers)
+        self.rng.shuffle(peers)
         round = history.current_round()
-        if round == 0:
-            self.initialize_beliefs(peers)
+        # Everyone is new in round 0; with --neighbors, new neighbors can
+        # turn up later too.
+        self.initialize_beliefs([peer for peer in peers
+                                 if peer.id not in self.unchoking_beliefs])
         # request all available pieces from all peers!
         # (up to self.max_requests from each)
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
-            if isect==set():
+            isect = peer.available_bits & np_bits
+            if not isect:
                 continue
             n = min(self.max_requests, len(isect))
 
@@ -99,7 +95,7 @@ class LfslTourney(Peer):
                     req = Request(self.id, peer.id, piece_id, start_block)
                     requests.append(req)
             else:
-                for piece_id in random.sample(isect, n):
+                for piece_id in self.rng.sample(list(isect), n):
                     # aha! The peer has this piece! Request it.
                     # which part of the piece do we need next?
                     # (must get the next-needed blocks in order)
@@ -110,7 +106,7 @@ class LfslTourney(Peer):
 
     def initialize_beliefs(self, peers):
         logging.debug('initializing')
-        logging.debug(str(peers))
+        logging.debug("%s", peers)
         for peer in peers:
             self.download_beliefs[peer.id] = 1
             self.upload_beliefs[peer.id] = 1
@@ -150,6 +146,8 @@ class LfslTourney(Peer):
             # update list of whether we unchoked them
             we_unchoked = set(upload.to_id for upload in last_uploads)
             for pid in we_unchoked:
+                if not self.unchoking_beliefs[pid]:
+                    continue  # no longer a neighbor since we met
                 # if they didn't unchoke us, increase the upload belief
                 if not self.unchoking_beliefs[pid][-1]:
                     self.upload_beliefs[pid] *= (1 + self.alpha)
@@ -158,10 +156,10 @@ class LfslTourney(Peer):
                     self.download_beliefs[pid] = self.download_nums[pid]
                 if sum(self.unchoking_beliefs[pid]) == 3:
                     self.upload_beliefs[pid] *= (1 - self.gamma)
-        logging.debug('Download beliefs for %s %s' % (self.id, str(self.download_nums)))
-        logging.debug('last downloads %s', str(last_downloads))
-        logging.debug('Upload beliefs for %s %s' % (self.id, str(self.upload_beliefs)))
-        logging.debug('Unchoking beliefs for %s %s' % (self.id, str(self.unchoking_beliefs)))
+        logging.debug('Download beliefs for %s %s', self.id, self.download_nums)
+        logging.debug('last downloads %s', last_downloads)
+        logging.debug('Upload beliefs for %s %s', self.id, self.upload_beliefs)
+        logging.debug('Unchoking beliefs for %s %s', self.id, self.unchoking_beliefs)
 
     def uploads(self, requests, peers, history):
         """
@@ -175,8 +173,7 @@ class LfslTourney(Peer):
         """
 
         round = history.current_round()
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
@@ -207,14 +204,14 @@ class LfslTourney(Peer):
                 ratios = dict()
                 requesters = [request.requester_id for request in requests]
                 for requester in requesters:
-                    logging.debug('download_beliefs' + str(self.download_beliefs))
+                    logging.debug('download_beliefs%s', self.download_beliefs)
                     logging.debug(self.download_beliefs[requester])
                     logging.debug(self.upload_beliefs[requester])
                     ratios[requester] = self.download_beliefs[requester] * 1.0 / self.upload_beliefs[requester]
 
                 ratios_sorted = sorted(ratios.items(), key = lambda x: x[1], reverse = True)
                 logging.debug('ratios')
-                logging.debug(str(ratios_sorted))
+                logging.debug("%s", ratios_sorted)
                 bandwidth_used = 0
                 chosen, bws = [], []
                 for pid, ratio in ratios_sorted:
@@ -1,6 +1,26 @@
 #!/usr/bin/python
 
-class Upload:
+# Long runs create millions of these, and the History keeps all of them,
+# so they use __slots__ rather than a per-instance __dict__.
+
+class Message(object):
+    """
+    Base for the slotted message classes.  Classes with __slots__ need
+    their own pickling support for the older pickle protocols.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for (k, v) in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+
+class Upload(Message):
+    __slots__ = ('from_id', 'to_id', 'bw')
+
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
         self.to_id = to_id
@@ -10,7 +30,9 @@ class Upload:
         return "Upload(from_id = %s, to_id=%s, bw=%d)" % (
             self.from_id, self.to_id, self.bw)
 
-class Request:
+class Request(Message):
+    __slots__ = ('requester_id', 'peer_id', 'piece_id', 'start')
+
     def __init__(self, requester_id, peer_id, piece_id, start):
         self.requester_id = requester_id
         self.peer_id = peer_id   # peer data is requested from
@@ -21,10 +43,12 @@ class Request:
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
-class Download:
+class Download(Message):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
+    __slots__ = ('from_id', 'to_id', 'piece', 'blocks')
+
     def __init__(self, from_id, to_id, piece, blocks):
         self.from_id = from_id  # who did the agent download from?
         self.to_id = to_id      # Who downloaded?
@@ -38,14 +62,21 @@ class Download:
 
 
             
-class PeerInfo:
+class PeerInfo(Message):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
+
+    available_pieces: set of piece ids
+    available_bits: the same pieces as a piecebits.PieceBits, for fast
+                    intersection and counting
     """
-    def __init__(self, id, available):
+    __slots__ = ('id', 'available_pieces', 'available_bits')
+
+    def __init__(self, id, available, available_bits=None):
         self.id = id
         self.available_pieces = available
+        self.available_bits = available_bits
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
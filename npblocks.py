@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+"""
+NumPy engine for the sim: keeps the swarm's block counts as a peers x pieces
+matrix, with a boolean bitmap of which peers have finished which pieces, and
+applies each round's transfers with array operations.  Selected with
+--engine numpy.  Agents still see the usual Peer.requests/Peer.uploads API.
+"""
+
+import itertools
+
+import numpy as np
+
+from messages import Download
+
+
+class NumpyBlockTable:
+    """
+    Same interface as blocks.BlockTable.
+
+    blocks: float matrix, blocks[i, piece] = blocks peer i has of piece
+    have: bool matrix, have[i, piece] = peer i has all of piece
+    missing: int vector, missing[i] = pieces peer i doesn't have yet
+    counts: int vector, counts[piece] = peers that have piece
+    index: dict : peer_id -> row number
+    """
+    def __init__(self, blocks_per_piece, rows):
+        """
+        rows: dict : peer_id -> [blocks of each piece]
+        """
+        self.blocks_per_piece = blocks_per_piece
+        self.ids = list(rows.keys())
+        self.index = dict((pid, i) for (i, pid) in enumerate(self.ids))
+        self.blocks = np.array([rows[pid] for pid in self.ids], dtype=float)
+        self.have = self.blocks == blocks_per_piece
+        self.missing = (~self.have).sum(axis=1)
+        self.not_done = int(np.count_nonzero(self.missing))
+        self.counts = self.have.sum(axis=0)
+        self.newly_done = [self.ids[i]
+                           for i in np.flatnonzero(self.missing == 0)]
+        self.make_views()
+
+    def make_views(self):
+        """Read-only views of the counts and of each peer's row."""
+        self.counts_view = self.counts[:]
+        self.counts_view.flags.writeable = False
+        self.views = dict()
+        for (pid, i) in self.index.items():
+            view = self.blocks[i]
+            view.flags.writeable = False
+            self.views[pid] = view
+
+    def __getstate__(self):
+        # Pickling a view copies it, so leave them out and make new ones.
+        state = dict(self.__dict__)
+        del state["views"]
+        del state["counts_view"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.make_views()
+
+    def __getitem__(self, peer_id):
+        return self.blocks[self.index[peer_id]]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def view(self, peer_id):
+        return self.views[peer_id]
+
+    def piece_counts(self):
+        """Read-only view of the rarity index: peers having each piece."""
+        return self.counts_view
+
+    def uncount(self, pieces):
+        """As BlockTable.uncount."""
+        self.counts[pieces] -= 1
+
+    def add_blocks(self, peer_id, piece_id, blocks):
+        """
+        Give peer_id blocks more blocks of piece_id.  Returns True if that
+        completed the piece.
+        """
+        i = self.index[peer_id]
+        self.blocks[i, piece_id] += blocks
+        if self.blocks[i, piece_id] != self.blocks_per_piece:
+            return False
+        self.have[i, piece_id] = True
+        self.counts[piece_id] += 1
+        self.missing[i] -= 1
+        if self.missing[i] == 0:
+            self.not_done -= 1
+            self.newly_done.append(peer_id)
+        return True
+
+    def transfer(self, requests, uploads):
+        """
+        Process the uploads: figure out how many blocks of all the requested
+        pieces the requesters ended up with, and add them to the matrix.
+        Gives the same result as BlockTable.transfer, fractional bandwidth
+        included: each uploader's bandwidth goes to the requester's
+        requests to it in order, and only the biggest transfer of each
+        piece to a requester counts.
+
+        Returns (downloads, completed), as BlockTable.transfer does, in the
+        same order, so agents see the same history and available pieces
+        on either engine.
+
+        Both engines, on random fractional uploads to peers that already
+        have some pieces in full (as with --files):
+        >>> import random
+        >>> from blocks import BlockTable
+        >>> from messages import Request, Upload
+        >>> def both(seed):
+        ...     rng = random.Random(seed)
+        ...     ids = ["p%d" % i for i in range(8)]
+        ...     rows = dict((p, [rng.choice([0, 0.3, 1.7, 4])
+        ...                      for k in range(6)]) for p in ids)
+        ...     requests = dict((p, [Request(p, q, k, rows[p][k])
+        ...                          for q in ids if q != p
+        ...                          for k in range(6) if rows[p][k] < 4])
+        ...                     for p in ids)
+        ...     uploads = dict((p, [Upload(p, q, rng.uniform(0, 3))
+        ...                         for q in rng.sample(ids, 3) if q != p])
+        ...                    for p in ids)
+        ...     out = []
+        ...     for table in (BlockTable(4, rows), NumpyBlockTable(4, rows)):
+        ...         (downloads, completed) = table.transfer(requests, uploads)
+        ...         out.append(([(d.from_id, d.to_id, d.piece, d.blocks)
+        ...                      for p in ids for d in downloads[p]],
+        ...                     completed, table.take_newly_done()))
+        ...     return out[0] == out[1]
+        >>> all(both(seed) for seed in range(20))
+        True
+        """
+        index = self.index
+        bpp = self.blocks_per_piece
+
+        # (uploader, requester) -> bw, and the uploaders giving each
+        # requester anything.  Only the first upload counts.
+        rate = dict()
+        granted = dict()  # requester -> set(uploaders)
+        for (uploader_id, us) in uploads.iteritems():
+            for u in us:
+                key = (uploader_id, u.to_id)
+                if key not in rate:
+                    rate[key] = u.bw
+                    if u.bw != 0:
+                        granted.setdefault(u.to_id, set()).add(uploader_id)
+
+        # Flatten the requests that get any bandwidth, grouped by requester
+        # and then by the peer asked, in request order within each group.
+        # Each uploader's bandwidth goes to the requests to it in order, a
+        # request getting whatever is left after the ones before it.  That
+        # is worked out here as BlockTable.transfer does, by taking each
+        # request's blocks off what's left: differencing a running total
+        # instead leaves rounding residues that look like tiny transfers.
+        to_idx, from_idx, piece, alloced = [], [], [], []
+        get_peer_id = lambda r: r.peer_id
+        for requester_id in requests:
+            uploaders = granted.get(requester_id)
+            if uploaders is None:
+                continue
+            t = index[requester_id]
+            left = dict()  # uploader -> bw still to give
+            for r in sorted([r for r in requests[requester_id]
+                             if r.peer_id in uploaders], key=get_peer_id):
+                peer_id = r.peer_id
+                bw = left.get(peer_id)
+                if bw is None:
+                    bw = rate[(peer_id, requester_id)]
+                if bw == 0:
+                    continue
+                blocks = min(bw, bpp - r.start)
+                left[peer_id] = bw - blocks
+                to_idx.append(t)
+                from_idx.append(index[peer_id])
+                piece.append(r.piece_id)
+                alloced.append(blocks)
+
+        downloads = dict((requester_id, []) for requester_id in requests)
+        if len(to_idx) == 0:
+            return (downloads, [])
+
+        to_idx = np.array(to_idx)
+        from_idx = np.array(from_idx)
+        piece = np.array(piece)
+        alloced = np.array(alloced, dtype=float)
+        position = np.arange(len(alloced))
+
+        # Requesting the same piece from several peers doesn't stack: keep
+        # the biggest transfer of each (requester, piece), earliest on ties.
+        key = to_idx * self.blocks.shape[1] + piece
+        order = np.lexsort((position, -alloced, key))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key[order][1:] != key[order][:-1]
+        keep = order[first]
+        # Where each kept transfer's piece was first asked for, among the
+        # transfers to its requester.
+        asked = np.minimum.reduceat(position[order], np.flatnonzero(first))
+        to_idx, from_idx = to_idx[keep], from_idx[keep]
+        piece, alloced = piece[keep], alloced[keep]
+
+        self.blocks[to_idx, piece] += alloced
+        done = self.blocks[to_idx, piece] == bpp
+        self.have[to_idx[done], piece[done]] = True
+        np.subtract.at(self.missing, to_idx[done], 1)
+        np.add.at(self.counts, piece[done], 1)
+
+        # Hand back the downloads, finished pieces and newly done peers in
+        # the order BlockTable.transfer does: requester by requester, and
+        # within a requester in the order its dict of pieces iterates.
+        # That dict is built here the same way, with the pieces added in
+        # the order they were first asked for, so it iterates the same.
+        emit = np.argsort(asked, kind="mergesort")
+        ids = self.ids
+        missing = self.missing
+        completed = []
+        rows = zip(to_idx[emit].tolist(), from_idx[emit].tolist(),
+                   piece[emit].tolist(), alloced[emit].tolist(),
+                   done[emit].tolist())
+        for (t, group) in itertools.groupby(rows, lambda row: row[0]):
+            best = dict()  # piece -> (blocks, from, finished it)
+            for (t, f, p, b, d) in group:
+                best[p] = (b, f, d)
+            requester_id = ids[t]
+            finished = False
+            for (p, (b, f, d)) in best.iteritems():
+                if d:
+                    completed.append((requester_id, p))
+                    finished = True
+            if finished and missing[t] == 0:
+                self.not_done -= 1
+                self.newly_done.append(requester_id)
+            downloads[requester_id] = [
+                Download(ids[f], requester_id, p, b)
+                for (p, (b, f, d)) in best.iteritems()]
+        return (downloads, completed)
+
+    def take_newly_done(self):
+        """
+        Return the ids of the peers that got their last piece since the
+        last call (or that started with every piece), and forget them.
+        """
+        done = self.newly_done
+        self.newly_done = []
+        return done
+
+    def is_done(self, peer_id):
+        return self.missing[self.index[peer_id]] == 0
+
+    def all_done(self):
+        return self.not_done == 0
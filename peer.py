@@ -5,9 +5,16 @@ from messages import Upload, Request
 from util import even_split
 
 class Peer:
-    def __init__(self, config, id, init_pieces, up_bandwidth):
+    # Whether the agent reads self.piece_counts.  The sim doesn't keep the
+    # counts up to date for classes that set this False.
+    reads_piece_counts = True
+
+    def __init__(self, config, id, init_pieces, up_bandwidth, rng=None):
         self.conf = config
         self.id = id
+        # This peer's own random stream.  Use it instead of the random
+        # module, so that runs can be reproduced peer by peer.
+        self.rng = rng if rng is not None else random.Random()
         self.pieces = init_pieces[:]
         # bandwidth measured in blocks-per-time-period
         self.up_bw = up_bandwidth
@@ -17,6 +24,9 @@ class Peer:
         self.max_requests = self.conf.max_up_bw / self.conf.blocks_per_piece + 1
         self.max_requests = min(self.max_requests, self.conf.num_pieces)
 
+        # piece_id -> number of peers that have it; set by the sim
+        self.piece_counts = None
+
         self.post_init()
 
     def __repr__(self):
@@ -31,6 +41,14 @@ class Peer:
         """
         self.pieces = new_pieces
 
+    def update_piece_counts(self, piece_counts):
+        """
+        Called by the sim before requests() with a read-only, swarm-wide
+        rarity index: piece_counts[i] is the number of peers that have all
+        of piece i.  Rarest-first agents can read it instead of counting.
+        """
+        self.piece_counts = piece_counts
+
     def requests(self, peers, history):
         return []
 
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+
+class PieceBits(object):
+    """
+    An immutable set of piece ids, stored as the bits of one int: piece i
+    is in the set if bit i is on.  Intersecting two of these is a single
+    int operation instead of a set copy, so agents can do
+
+        isect = peer.available_bits & my_needed_bits
+
+    once per peer per round cheaply.  Iterates in increasing piece order.
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    @staticmethod
+    def from_pieces(pieces):
+        bits = 0
+        for i in pieces:
+            bits |= 1 << i
+        return PieceBits(bits)
+
+    def with_piece(self, i):
+        """Return a new PieceBits that also contains piece i."""
+        return PieceBits(self.bits | (1 << i))
+
+    def __and__(self, other):
+        return PieceBits(self.bits & other.bits)
+
+    def __or__(self, other):
+        return PieceBits(self.bits | other.bits)
+
+    def __contains__(self, i):
+        return (self.bits >> i) & 1 == 1
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __eq__(self, other):
+        return isinstance(other, PieceBits) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __repr__(self):
+        return "PieceBits(%s)" % list(self)
@@ -1,24 +1,60 @@
 #!/usr/bin/python
 
-import random
+from operator import attrgetter
+
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
 
+MAX_UPLOAD = 4  # max num of peers to upload to at a time
+
+get_requester_id = attrgetter("requester_id")
+
 class Seed(Peer):
+    reads_piece_counts = False
+
     def requests(self, peers, history):
         # Seeds don't need anything.
         return []
 
     def uploads(self, requests, peers, history):
-        max_upload = 4  # max num of peers to upload to at a time
-        requester_ids = list(set(map(lambda r: r.requester_id, requests)))
-
-        n = min(max_upload, len(requester_ids))
-        if n == 0:
-            return []
-        bws = even_split(self.up_bw, n)
-        uploads = [Upload(self.id, p_id, bw)
-                   for (p_id, bw) in zip(random.sample(requester_ids, n), bws)]
-        
-        return uploads
+        return seed_uploads(self, requests, dict())
+
+    @staticmethod
+    def batch_uploads(seeds, inbox):
+        """
+        uploads() for a whole list of Seeds in one go, for the sim.  Gives
+        the same uploads, with the same draws from each seed's rng, as
+        calling uploads() on each seed.  Only for plain Seeds, not
+        subclasses that change uploads().
+
+        This is still a loop over the seeds, not a vectorized step: each
+        seed has to draw from its own rng, in turn, for the uploads to stay
+        the same.  What it saves over calling uploads() is the sim's
+        per-peer work around the call (the peer list, the upload checks)
+        and working out the same bandwidth split over and over.
+
+        inbox: dict : peer_id -> [requests to that peer]
+        Returns dict : seed id -> [uploads]
+        """
+        splits = dict()  # bandwidth splits are shared between the seeds
+        return dict((s.id, seed_uploads(s, inbox[s.id], splits))
+                    for s in seeds)
+
+
+def seed_uploads(seed, requests, splits):
+    """
+    Upload evenly to up to MAX_UPLOAD of the requesters, picked at random.
+    splits: dict : (up_bw, n) -> even_split(up_bw, n), filled in as needed
+    """
+    requester_ids = list(set(map(get_requester_id, requests)))
+
+    n = min(MAX_UPLOAD, len(requester_ids))
+    if n == 0:
+        return []
+    key = (seed.up_bw, n)
+    if key not in splits:
+        splits[key] = even_split(seed.up_bw, n)
+    return [Upload(seed.id, p_id, bw)
+            for (p_id, bw) in zip(seed.rng.sample(requester_ids, n),
+                                  splits[key])]
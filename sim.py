@@ -6,27 +6,144 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
   - regular peers, which start with no pieces.
 
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
+
+With --files, several files are shared at once in the one swarm, each with its own pieces.  Seeds have every file; each regular peer shares --files-per-peer of them, and its one upload bandwidth is shared between all of its files.  The run ends once every peer has all of its files.
 """
 
+import os
 import re
+import cPickle
 import random
 import sys
 import logging
-import copy
 import itertools
+import multiprocessing
 import pprint
 from optparse import OptionParser
+from array import array
 
 from messages import Upload, Request, Download, PeerInfo
 from util import *
 from stats import Stats
 from history import History
+from blocks import BlockTable, PieceView
+from piecebits import PieceBits
+from tracefile import open_sink
+from timing import Timers
+from seed import Seed
+from swarmview import SwarmView
+
+
+# The smallest --history-window allowed: the shipped agents look up to 3
+# rounds back.  An agent that looks further back than the window gets an
+# IndexError from its history.
+MIN_HISTORY_WINDOW = 3
+
+# Why a run stopped -> what gets logged.
+STOP_MESSAGES = {
+    "done": "All done!",
+    "out_of_time": "Out of time.  Stopping.",
+    "no_downloads": "Nothing downloaded for %(stall_rounds)d rounds.  Stopping.",
+}
+
+
+class SimState:
+    """
+    Everything a run carries from one round to the next: the agents
+    themselves, the block table, which pieces each peer has available, the
+    history so far, and the round number.  Kept in one object so that a run
+    can be pickled between rounds and resumed later (see --checkpoint).
+
+    With --files, files: dict : peer_id -> the files it shares.  Pieces of
+    the other files are only placeholders in its row of the block table,
+    and aren't available from it.
+    """
+    def __init__(self, config, seed, peers, peer_pieces, up_bws, history,
+                 files=None):
+        self.config = config
+        self.seed = seed      # the iteration's seed
+        self.round = 0        # the next round to run
+        self.done = False
+        # For stall detection: how many rounds in a row nothing was
+        # downloaded.
+        self.rounds_without_downloads = 0
+        self.peers = peers
+        self.peer_ids = [p.id for p in peers]
+        self.peers_by_id = dict((p.id, p) for p in peers)
+        # The plain Seeds, whose uploads the sim works out in one batch.
+        self.seeds = [p for p in peers if p.__class__ is Seed]
+        self.seed_ids = set(p.id for p in self.seeds)
+        self.peer_pieces = peer_pieces  # blocks of each piece, by peer id
+        self.up_bws = up_bws            # peer_id -> up_bw
+        self.history = history
+
+        # dict : pid -> set(finished / available pieces)
+        self.available = dict(
+            (pid, set(available_pieces(config, peer_pieces, pid,
+                                       files and files[pid])))
+            for pid in self.peer_ids)
+        # dict : pid -> PieceBits of the same pieces.  Immutable, so they
+        # can be handed out without copying.
+        self.available_bits = dict(
+            (pid, PieceBits.from_pieces(self.available[pid]))
+            for pid in self.peer_ids)
+        # The PeerInfo of each peer, in peers order.  add_available
+        # replaces a peer's when its pieces change, and drops swarm, the
+        # tuple of them every SwarmView shares, to be rebuilt when next
+        # needed.
+        self.peer_index = dict((pid, i) for (i, pid) in enumerate(self.peer_ids))
+        self.peer_infos = [PeerInfo(pid, self.available[pid],
+                                    self.available_bits[pid])
+                           for pid in self.peer_ids]
+        self.swarm = None
+
+        # With --files: the files each peer shares, and dict :
+        # (pid, file) -> pieces of it the peer is still missing.
+        self.files = files
+        self.file_missing = None
+        if files is not None:
+            n = config.file_pieces
+            self.file_missing = dict()
+            for pid in self.peer_ids:
+                have = dict()  # file -> pieces of it available
+                for i in self.available[pid]:
+                    have[i // n] = have.get(i // n, 0) + 1
+                for f in files[pid]:
+                    self.file_missing[(pid, f)] = n - have.get(f, 0)
+
+        # With --neighbors: dict : pid -> the indexes in peers of the peers
+        # it can see, and dict : pid -> set of their ids.  Redrawn every
+        # --neighbor-refresh rounds.  None means every peer sees every other.
+        self.neighbors = None
+        self.neighbor_ids = None
+        # And the rarity index over each peer's neighbors, in peers order:
+        # an array of how many of them have each piece, kept up to date by
+        # add_available.  None for peers that don't read piece counts.
+        self.neighbor_counts = None
+
+        # Picks the peers that get checked, with --validate sampled.
+        self.validate_rng = random.Random(derive_seed(seed, "validate"))
+
+        # The global random state, saved with each checkpoint.  Peers have
+        # their own streams, but agents may still use the random module.
+        self.random_state = None
 
 
 class Sim:
+    """
+    The lock-step model: every round, every peer makes its requests, then
+    every peer decides its uploads, then the round's transfers all happen
+    at once.  events.EventSim is the asynchronous alternative.
+    """
+    state_class = SimState
+
     def __init__(self, config):
         self.config = config
         self.up_bws_state = dict()
+        self.seed = None  # the seed of the iteration being run
+        # Phase timers, if --timing is on.  Added up over the iterations
+        # run_sim runs.
+        self.timers = Timers() if config.timing else None
 
 
     def up_bw(self, peer_id, reinit=False):
@@ -38,315 +155,552 @@ class Sim:
         if reinit and peer_id in s:
             del s[peer_id]
 
-        """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
-        else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
-
-        return s.setdefault(peer_id, the_up_bw)
-
-    def run_sim_once(self):
-        """Return a history"""
+        """Sets the upload bandwidth of seeds to max, other agents at random.
+        Each peer's is drawn from its own stream, so it doesn't depend on
+        which other peers are in the run."""
+        if peer_id not in s:
+            if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
+            else:
+                rng = random.Random(derive_seed(self.seed, "up_bw", peer_id))
+                the_up_bw = rng.randint(c.min_up_bw, c.max_up_bw)
+            s[peer_id] = the_up_bw
+
+        return s[peer_id]
+
+    def check_uploads(self, state, peer, uploads):
+        """Raise an IllegalUpload exception if there is a problem.  Checks
+        each upload in one pass."""
+        total = 0
+        for u in uploads:
+            if not isinstance(u, Upload):
+                msg = "List of Uploads contains non-Upload object."
+            elif u.to_id == peer.id:
+                msg = "Can't upload to yourself."
+            elif u.from_id != peer.id:
+                msg = "Upload.from != peer id."
+            elif u.bw < 0:
+                msg = "Upload bandwidth must be non-negative!"
+            else:
+                total += u.bw
+                continue
+            raise IllegalUpload(msg + " Bad element: %s" % u)
+
+        limit = state.up_bws[peer.id]
+        if total > limit:
+            raise IllegalUpload("Can't upload more than limit of %d. %s" % (
+                limit, uploads))
+
+        # If we got here, looks ok.
+
+    def check_requests(self, state, peer, requests):
+        """Raise an IllegalRequest exception if there is a problem.  Checks
+        each request in one pass."""
+        num_pieces = self.config.num_pieces
+        blocks_per_piece = self.config.blocks_per_piece
+        peers_by_id = state.peers_by_id
+        available = state.available
+        have = state.peer_pieces[peer.id]
+        neighbors = None
+        if state.neighbor_ids is not None:
+            neighbors = state.neighbor_ids[peer.id]
+        for r in requests:
+            if not isinstance(r, Request):
+                msg = "List of Requests contains non-Request object."
+            elif r.piece_id < 0 or r.piece_id >= num_pieces:
+                msg = "Request asks for non-existent piece!"
+            elif r.peer_id not in peers_by_id:
+                msg = "Request mentions non-existent peer!"
+            elif r.requester_id != peer.id:
+                msg = "Request has wrong peer id!"
+            elif neighbors is not None and r.peer_id not in neighbors:
+                msg = "Request asks a peer that isn't a neighbor!"
+            elif (r.start < 0 or r.start >= blocks_per_piece or
+                  r.start > have[r.piece_id]):
+                # Must request the _next_ necessary block
+                msg = "Request has bad start block!"
+            elif r.piece_id not in available[r.peer_id]:
+                msg = "Asking for piece peer does not have!"
+            else:
+                continue
+            raise IllegalRequest(msg + " Bad element: %s" % r)
+
+        # If we got here, looks ok
+
+    def peers_to_check(self, state):
+        """
+        The ids of the peers whose requests and uploads get checked this
+        round, by config.validate:
+          full: every peer's
+          sampled: each peer's with probability config.validate_fraction,
+                   drawn afresh every round
+          off: none -- only for agents that are trusted to play by the rules
+        """
+        mode = self.config.validate
+        if mode == "full":
+            return state.peers_by_id
+        elif mode == "off":
+            return ()
+        rng = state.validate_rng
+        fraction = self.config.validate_fraction
+        return set(pid for pid in state.peer_ids if rng.random() < fraction)
+
+    def refresh_neighbors(self, state):
+        """With --neighbors, draw new neighborhoods at the start of every
+        --neighbor-refresh rounds, as if every peer re-announced to the
+        tracker."""
+        conf = self.config
+        if conf.neighbors is None or state.round % conf.neighbor_refresh:
+            return
+        rng = random.Random(derive_seed(state.seed, "neighbors", state.round))
+        graph = random_neighbors(len(state.peers), conf.neighbors, rng)
+        ids = state.peer_ids
+        state.neighbors = dict(zip(ids, graph))
+        state.neighbor_ids = dict((pid, set(ids[j] for j in ns))
+                                  for (pid, ns) in zip(ids, graph))
+        infos = state.peer_infos
+        state.neighbor_counts = counts = [None] * len(ids)
+        for (i, p) in enumerate(state.peers):
+            if not p.reads_piece_counts:
+                continue
+            c = counts[i] = array('i', [0] * conf.num_pieces)
+            for j in graph[i]:
+                for piece in infos[j].available_bits:
+                    c[piece] += 1
+
+    def swarm(self, state):
+        """The tuple of every peer's PeerInfo, in state.peers order, as it
+        is now."""
+        if state.swarm is None:
+            state.swarm = tuple(state.peer_infos)
+        return state.swarm
+
+    def peers_seen(self, state, p, swarm, copy=False):
+        """
+        The PeerInfos peer p is shown: its neighbors', with --neighbors, or
+        a SwarmView of every other peer's.  swarm: as from self.swarm.
+
+        With copy, a plain list instead of the SwarmView.  Agents' requests()
+        shuffle or sort their peers, which would copy a SwarmView anyway and
+        then go through it a swap at a time; a list copied in one go is
+        much faster for that.
+        """
+        if state.neighbors is not None:
+            return [swarm[i] for i in state.neighbors[p.id]]
+        i = state.peer_index[p.id]
+        if copy:
+            others = list(swarm)
+            del others[i]
+            return others
+        return SwarmView(swarm, i)
+
+    def peer_files(self, peer_id):
+        """
+        The files peer_id shares, with --files.  Seeds are seedboxes, with
+        every file; other peers share --files-per-peer of them, picked from
+        their own stream.
+        """
+        c = self.config
+        if peer_id.startswith("Seed") or c.files_per_peer is None:
+            return range(c.files)
+        rng = random.Random(derive_seed(self.seed, "files", peer_id))
+        return sorted(rng.sample(xrange(c.files), min(c.files_per_peer,
+                                                      c.files)))
+
+    def piece_counts(self, state, p):
+        """
+        The rarity index peer p is given, read-only: with --neighbors, how
+        many of its neighbors have each piece, since those are the only
+        peers it can see; otherwise the block table's, over the whole swarm.
+        """
+        if state.neighbors is None:
+            return state.peer_pieces.piece_counts()
+        return PieceView(state.neighbor_counts[state.peer_index[p.id]])
+
+    def create_peers(self):
+        """Each agent class must be already loaded, and have a
+        constructor that takes the config, id,  pieces, up bandwidth and
+        random stream, in that order.  Returns (peers, block table, files),
+        with files as for SimState."""
         conf = self.config
-        # Keep track of the current round.  Needs to be in scope for helpers.
-        round = 0
-
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
-
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
-
-            limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
-                raise IllegalUpload("Can't upload more than limit of %d. %s" % (
-                    limit, uploads))
-
-            # If we got here, looks ok.
-
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
-
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
-
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
-
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-
-            # If we got here, looks ok
-
-        def available_pieces(peer_id, peer_pieces):
-            """
-            Return a list of piece ids that this peer has available.
-            """
-            return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
-                          range(conf.num_pieces))
-
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-
-        def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
-                else:
-                    result = False
-            return result
-
-        def create_peers():
-            """Each agent class must be already loaded, and have a
-            constructor that takes the config, id,  pieces, and
-            up and down bandwidth, in that order."""
-
-            def load(class_name, params):
-                agent_class = conf.agent_classes[class_name]
-                return agent_class(*params)
-
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
-
-            n = len(conf.agent_class_names)
-            ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
-
-            is_seed = lambda id: id.startswith("Seed")
-
-            def get_pieces(id):
-                if id.startswith("Seed"):
-                    return [conf.blocks_per_piece]*conf.num_pieces
-                else:
-                    return [0]*conf.num_pieces
-
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
-            pieces = [get_pieces(id) for id in ids]
-            r = itertools.repeat
-
-            # Re-initialize upload bandwidths at the beginning of each
-            # new simulation
-            up_bws = [self.up_bw(id, reinit=True) for id in ids]
-            params = zip(r(conf), ids, pieces, up_bws)
-
-            peers = map(load, conf.agent_class_names, params)
-            #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
-            return peers, peer_pieces
-
-        def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            pieces = copy.copy(peer_pieces[p.id])
-            # Made copy of pieces and the peer info this peer needs to make it's
-            # decision, so that it can't change the simulation's copies.
-            p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
-            return rs
-
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
-            return us
-
-        def upload_rate(uploads, uploader_id, requester_id):
-            """
-            return the uploading rate from uploader to requester
-            in blocks per time period, or 0 if not uploading.
-            """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
-
-        def update_peer_pieces(peer_pieces, requests, uploads, available):
-            """
-            Process the uploads: figure out how many blocks of all the requested
-            pieces the requesters ended up with.
-            Make sure requesting the same thing from lots of peers doesn't
-            stack.
-            update the sets of available pieces as needed.
-            """
-            downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
-            for requester_id in requests:
-                # Keep track of how many blocks of each piece this
-                # requester got.  piece -> (blocks, from_who)
-                new_blocks_per_piece = dict()
-                def update_count(piece_id, blocks, peer_id):
-                    if piece_id in new_blocks_per_piece:
-                        old = new_blocks_per_piece[piece_id][0]
-                        if blocks > old:
-                            new_blocks_per_piece[piece_id] = (blocks, peer_id)
-                    else:
-                        new_blocks_per_piece[piece_id] = (blocks, peer_id)
-
-                # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
-                for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
-                    bw = upload_rate(uploads, peer_id, requester_id)
-                    if bw == 0:
-                        continue
-                    # This bandwidth gets applied in order to each piece requested
-                    for r in rs_for_peer:
-                        needed_blocks = conf.blocks_per_piece - r.start
-                        alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
-                        bw -= alloced_bw
-                        if bw == 0:
-                            break
-                for piece_id in new_blocks_per_piece:
-                    (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
-                        available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
-
-            return (new_pp, downloads)
-
-        def completed_pieces(peer_id, available):
-            return len(available[peer_id])
-
-        def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
-
-
-        logging.debug("Starting simulation with config: %s" % str(conf))
-
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
-        self.peers_by_id = dict((p.id, p) for p in peers)
-
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
-
-        # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
-                         for pid in self.peer_ids)
-
-        # Begin the event loop
-        while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
-            requests = dict()  # peer_id -> list of Requests
-            uploads = dict()   # peer_id -> list of Uploads
-            h = dict()
-            for p in peers:
-                h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
-
-            for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-
-
-            (peer_pieces, downloads) = update_peer_pieces(
-                peer_pieces, requests, uploads, available)
-            history.update(downloads, uploads)
-
-            logging.debug(history.pretty_for_round(round))
-
-            log_peer_info(peer_pieces, available)
-
-            if all_done(peer_pieces):
-                logging.info("All done!")
-                break
-            round += 1
-            if round > conf.max_round:
-                logging.info("Out of time.  Stopping.")
-                break
-
-        logging.info("Game history:\n%s" % history.pretty())
-
-        logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
 
+        def load(class_name, params):
+            agent_class = conf.agent_classes[class_name]
+            return agent_class(*params)
+
+        counts = dict()
+        def index(name):
+            if name in counts:
+                a = counts[name]
+                counts[name] += 1
+            else:
+                a = 0
+                counts[name] = 1
+            return a
+
+        n = len(conf.agent_class_names)
+        ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
+
+        is_seed = lambda id: id.startswith("Seed")
+
+        files = None
+        placeholders = dict()  # id -> pieces of files it doesn't share
+        if conf.files > 1:
+            files = dict((id, self.peer_files(id)) for id in ids)
+            n = conf.file_pieces
+            for id in ids:
+                shared = set(files[id])
+                placeholders[id] = [i for i in xrange(conf.num_pieces)
+                                    if i // n not in shared]
+
+        def get_pieces(id):
+            if id.startswith("Seed"):
+                pieces = [conf.blocks_per_piece]*conf.num_pieces
+            else:
+                pieces = [0]*conf.num_pieces
+            # Pieces of files a peer doesn't share are held as if finished,
+            # so it never asks for them and is done when its own files are.
+            for i in placeholders.get(id, ()):
+                pieces[i] = conf.blocks_per_piece
+            return pieces
+
+        # id -> blocks of each piece
+        table_class = block_table_class(conf.engine)
+        peer_pieces = table_class(conf.blocks_per_piece,
+                                  dict((id, get_pieces(id)) for id in ids))
+        for id in ids:
+            if placeholders.get(id):
+                peer_pieces.uncount(placeholders[id])
+        pieces = [get_pieces(id) for id in ids]
+        r = itertools.repeat
+
+        # Re-initialize upload bandwidths at the beginning of each
+        # new simulation
+        up_bws = [self.up_bw(id, reinit=True) for id in ids]
+        rngs = [random.Random(derive_seed(self.seed, "peer", id)) for id in ids]
+        params = zip(r(conf), ids, pieces, up_bws, rngs)
+
+        peers = map(load, conf.agent_class_names, params)
+        #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
+        return peers, peer_pieces, files
+
+    def start(self, trace_path=None):
+        """Set up a new run, and return its SimState."""
+        conf = self.config
+        logging.debug("Starting simulation with config: %s", conf)
+
+        peers, peer_pieces, files = self.create_peers()
+        peer_ids = [p.id for p in peers]
+
+        upload_rates = dict((id, self.up_bw(id)) for id in peer_ids)
+        sink = None
+        if trace_path is not None:
+            sink = open_sink(trace_path, conf.trace_format)
+        file_pieces = conf.file_pieces if conf.files > 1 else None
+        history = History(peer_ids, upload_rates, conf.history_window, sink,
+                          file_pieces)
+        return self.state_class(conf, self.seed, peers, peer_pieces,
+                                self.up_bws_state, history, files)
+
+    def get_peer_requests(self, state, p, swarm, peer_history, check=True):
+        others = self.peers_seen(state, p, swarm, copy=True)
+        t = self.timers
+        if t: mark = t.now()
+        # The peer gets a read-only view of its pieces, so that it can't
+        # change the simulation's copy.
+        p.update_pieces(state.peer_pieces.view(p.id))
+        if p.reads_piece_counts:
+            p.update_piece_counts(self.piece_counts(state, p))
+        rs = p.requests(others, peer_history)
+        if t: mark = t.lap(("requests", p.__class__.__name__), mark)
+        if check:
+            self.check_requests(state, p, rs)
+            if t: t.lap("check_requests", mark)
+        return rs
+
+    def route_requests(self, state, all_requests):
+        """
+        Build the inbox for this round in one pass over all the requests:
+        dict : peer_id -> [requests addressed to that peer]
+        Each list keeps the order the requests were made in.
+        """
+        inbox = dict((pid, []) for pid in state.peer_ids)
+        for rs in all_requests.values():
+            for r in rs:
+                inbox[r.peer_id].append(r)
+        return inbox
+
+    def get_peer_uploads(self, state, requests, p, swarm, peer_history,
+                         check=True):
+        others = self.peers_seen(state, p, swarm)
+        t = self.timers
+        if t: mark = t.now()
+        us = p.uploads(requests, others, peer_history)
+        if t: mark = t.lap(("uploads", p.__class__.__name__), mark)
+        if check:
+            self.check_uploads(state, p, us)
+            if t: t.lap("check_uploads", mark)
+        return us
+
+    def update_peer_pieces(self, state, requests, uploads):
+        """
+        Process the uploads: figure out how many blocks of all the requested
+        pieces the requesters ended up with.  The block table is updated in
+        place, and the sets and bitsets of available pieces as needed.
+        Returns the downloads: dict : peer_id -> [downloads]
+        """
+        (downloads, completed) = state.peer_pieces.transfer(requests, uploads)
+        self.count_progress(state, any(downloads.itervalues()))
+        self.add_available(state, completed)
+        return downloads
+
+    def add_available(self, state, completed):
+        """completed: [(peer_id, piece_id)] for pieces just finished"""
+        available = state.available
+        available_bits = state.available_bits
+        for (peer_id, piece_id) in completed:
+            available[peer_id].add(piece_id)
+            bits = available_bits[peer_id].with_piece(piece_id)
+            available_bits[peer_id] = bits
+            state.peer_infos[state.peer_index[peer_id]] = PeerInfo(
+                peer_id, available[peer_id], bits)
+        if completed:
+            state.swarm = None
+        if state.neighbors is not None:
+            # The neighbor graph is symmetric: the peers that see peer_id
+            # are its neighbors.
+            counts = state.neighbor_counts
+            for (peer_id, piece_id) in completed:
+                for j in state.neighbors[peer_id]:
+                    if counts[j] is not None:
+                        counts[j][piece_id] += 1
+        if state.file_missing is not None:
+            n = self.config.file_pieces
+            for (peer_id, piece_id) in completed:
+                key = (peer_id, piece_id // n)
+                state.file_missing[key] -= 1
+                if state.file_missing[key] == 0:
+                    state.history.peer_finished_file(state.round, peer_id,
+                                                     piece_id // n)
+
+    def count_progress(self, state, downloaded):
+        """Keep the count of rounds in a row without downloads, for
+        stop_reason.  Blocks only ever add up, so any download is progress,
+        even if it didn't finish a piece."""
+        if downloaded:
+            state.rounds_without_downloads = 0
+        else:
+            state.rounds_without_downloads += 1
+
+    def all_done(self, state):
+        # Record the peers that finished this round
+        for peer_id in state.peer_pieces.take_newly_done():
+            state.history.peer_is_done(state.round, peer_id)
+        return state.peer_pieces.all_done()
+
+    def log_peer_info(self, state):
+        if self.log_debug:
+            for p_id in state.peer_ids:
+                pieces = state.peer_pieces[p_id]
+                logging.debug("pieces for %s: %s", p_id, list(pieces))
+        log = ", ".join("%s:%s" % (p_id, len(state.available[p_id]))
+                        for p_id in state.peer_ids)
+        logging.info("Pieces completed: %s", log)
+
+    def run_round(self, state):
+        """Run round state.round, and move state on to the next one."""
+        logging.info("======= Round %d ========", state.round)
+
+        t = self.timers
+        if t: mark = t.now()
+        self.refresh_neighbors(state)
+        peers = state.peers
+        history = state.history
+        swarm = self.swarm(state)
+        check = self.peers_to_check(state)
+        if t: t.lap("peer_info", mark)
+        requests = dict()  # peer_id -> list of Requests
+        uploads = dict()   # peer_id -> list of Uploads
+        h = dict()
+        for p in peers:
+            h[p.id] = history.peer_history(p.id)
+            requests[p.id] = self.get_peer_requests(state, p, swarm,
+                                                    h[p.id], p.id in check)
+
+        if t: mark = t.now()
+        inbox = self.route_requests(state, requests)
+        if t: t.lap("route", mark)
+        if t: mark = t.now()
+        uploads.update(Seed.batch_uploads(state.seeds, inbox))
+        if t: t.lap(("uploads", "Seed"), mark)
+        for p in peers:
+            if p.id in state.seed_ids:
+                continue
+            uploads[p.id] = self.get_peer_uploads(state, inbox[p.id], p,
+                                                  swarm, h[p.id],
+                                                  p.id in check)
+
+        if t: mark = t.now()
+        downloads = self.update_peer_pieces(state, requests, uploads)
+        if t: t.lap("transfer", mark)
+        self.end_round(state, downloads, uploads)
+
+    def end_round(self, state, downloads, uploads):
+        """Record round state.round's downloads and uploads, and decide
+        whether the run stops after it."""
+        t = self.timers
+        if t: mark = t.now()
+        history = state.history
+        history.update(downloads, uploads)
+        if t: mark = t.lap("history", mark)
+
+        if self.log_debug:
+            logging.debug(history.pretty_for_round(state.round))
+
+        if self.log_info:
+            self.log_peer_info(state)
+        if t: mark = t.lap("logging", mark)
+
+        reason = self.stop_reason(state, self.all_done(state))
+        if t: t.lap("done", mark)
+        if reason is not None:
+            logging.info(STOP_MESSAGES[reason],
+                         {"stall_rounds": self.config.stall_rounds})
+            history.stopped(state.round, reason)
+            state.done = True
+        state.round += 1
+
+    def stop_reason(self, state, all_done):
+        """
+        Why the run stops after this round (one of STOP_MESSAGES), or None
+        if it carries on.  With config.stall_rounds N, a swarm that hasn't
+        downloaded anything for N rounds in a row is taken to be stuck.
+        """
+        if all_done:
+            return "done"
+        if state.round >= self.config.max_round:
+            return "out_of_time"
+        n = self.config.stall_rounds
+        if n and state.rounds_without_downloads >= n:
+            return "no_downloads"
+        return None
+
+    def finish(self, state):
+        """Log the stats for a finished run, and return its history."""
+        history = state.history
+        if self.log_info:
+            logging.info("Game history:\n%s", history.pretty())
+
+            logging.info("======== STATS ========")
+            logging.info("Uploaded blocks:\n%s",
+                         Stats.uploaded_blocks_str(state.peer_ids, history))
+            logging.info("Completion rounds:\n%s",
+                         Stats.completion_rounds_str(state.peer_ids, history))
+            logging.info("All done round: %s",
+                         Stats.all_done_round(state.peer_ids, history))
+            logging.info("Stopped after round %s: %s", history.stop_round,
+                         Stats.stop_reason(history))
+
+        history.close()
         return history
 
+    def run_sim_once(self, seed=None, trace_path=None, checkpoint_path=None):
+        """Return a history.  Each peer gets its own random stream, and its
+        own upload bandwidth, derived from seed and the peer's id (seed is
+        drawn at random if not given).  The global random state is reseeded
+        from seed too, so the iteration can be reproduced on its own.
+        If trace_path is given, the history is also streamed to that file
+        as the sim runs.
+
+        If checkpoint_path is given, the run's state is saved there every
+        config.checkpoint_every rounds and when it ends.  With
+        config.resume, a run that already has a checkpoint there carries on
+        from it instead of starting over (seed and trace_path are then
+        taken from the checkpoint)."""
+        # Check the log levels once per run, so that output nobody will see
+        # is never formatted.
+        root_logger = logging.getLogger()
+        self.log_info = root_logger.isEnabledFor(logging.INFO)
+        self.log_debug = root_logger.isEnabledFor(logging.DEBUG)
+
+        if (checkpoint_path is not None and self.config.resume and
+            os.path.exists(checkpoint_path)):
+            state = load_checkpoint(checkpoint_path)
+            self.up_bws_state = state.up_bws
+            self.seed = state.seed
+            logging.warning("Resuming %s at round %d", checkpoint_path,
+                            state.round)
+        else:
+            if seed is None:
+                seed = random.randint(0, sys.maxint)
+            self.seed = seed
+            random.seed(seed)
+            state = self.start(trace_path)
+
+        every = self.config.checkpoint_every
+        while not state.done:
+            self.run_round(state)
+            if checkpoint_path is not None and (
+                state.done or state.round % every == 0):
+                save_checkpoint(state, checkpoint_path)
+
+        return self.finish(state)
+
+    def iteration_seeds(self):
+        """
+        Derive one seed per iteration from the master seed (drawn at random
+        if there isn't one).  Each iteration reseeds from its own entry, so
+        results don't depend on which process runs it or in what order, and
+        iteration i gets the same seed in any run with the same master seed.
+        """
+        master = self.config.seed
+        if master is None:
+            master = random.randint(0, sys.maxint)
+        return [derive_seed(master, "iteration", i)
+                for i in range(self.config.iters)]
+
+    def iteration_path(self, path, i):
+        """
+        Where iteration i's file goes, given the path from the options (or
+        None).  With more than one iteration, the iteration number goes
+        before the extension.
+        """
+        if path is None or self.config.iters == 1:
+            return path
+        (root, ext) = os.path.splitext(path)
+        return "%s.%d%s" % (root, i, ext)
+
+    def trace_path(self, i):
+        """Where iteration i's trace goes, or None if not tracing."""
+        return self.iteration_path(self.config.trace, i)
+
+    def checkpoint_path(self, i):
+        """Where iteration i is checkpointed, or None if it isn't."""
+        return self.iteration_path(self.config.checkpoint, i)
+
     def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(),
-                        range(self.config.iters))
+        seeds = self.iteration_seeds()
+        iters = range(self.config.iters)
+        paths = map(self.trace_path, iters)
+        checkpoints = map(self.checkpoint_path, iters)
+        if self.config.workers > 1:
+            pool = multiprocessing.Pool(self.config.workers)
+            try:
+                results = pool.map(run_iteration,
+                                   [(self.config, s, p, c) for (s, p, c)
+                                    in zip(seeds, paths, checkpoints)])
+            finally:
+                pool.close()
+                pool.join()
+            histories = [h for (h, timers) in results]
+            if self.timers is not None:
+                for (h, timers) in results:
+                    self.timers.merge(timers)
+        else:
+            histories = map(self.run_sim_once, seeds, paths, checkpoints)
+        # Worker processes set up their own peers, so take the ids
+        # from the returned histories.
+        self.peer_ids = histories[0].peer_ids
+
         logging.warning("======== SUMMARY STATS ========")
 
         uploaded_blocks = map(
@@ -393,6 +747,116 @@ class Sim:
             cs = completion_by_id[p_id]
             logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
 
+        if self.config.files > 1:
+            self.log_file_stats(histories)
+
+        logging.warning("Stop reasons: %s", Stats.stop_reasons_str(histories))
+
+        if self.timers is not None:
+            logging.warning("======== TIMING ========\n%s",
+                            self.timers.table())
+
+
+    def log_file_stats(self, histories):
+        """With --files, log how many peers finished each file, how long
+        they took, and how many of its blocks were uploaded, averaged over
+        the iterations."""
+        done = map(Stats.file_completion_rounds, histories)
+        uploaded = map(Stats.file_uploaded_blocks, histories)
+        iters = float(len(histories))
+        logging.warning("Files: peers that finished, their completion round "
+                        "avg (stddev), blocks uploaded")
+        for f in xrange(self.config.files):
+            rounds = [r for d in done for r in d.get(f, dict()).values()]
+            blocks = sum(sum(u.get(f, dict()).values()) for u in uploaded)
+            when = "None"
+            if rounds:
+                when = "%.1f  (%.1f)" % (mean(rounds), stddev(rounds))
+            logging.warning("file %d: %.1f peers, %s, %.1f blocks" % (
+                f, len(rounds) / iters, when, blocks / iters))
+
+
+def block_table_class(engine):
+    """
+    Return the class that keeps the swarm's block counts for the named
+    engine.  The numpy engine is only imported when asked for, so numpy
+    stays an optional dependency.
+    """
+    if engine == "python":
+        return BlockTable
+    elif engine == "numpy":
+        from npblocks import NumpyBlockTable
+        return NumpyBlockTable
+    else:
+        raise ValueError("Unknown engine: %s" % engine)
+
+
+def sim_class(model):
+    """
+    Return the Sim class for the named model.  The event-driven one is only
+    imported when asked for.
+    """
+    if model == "rounds":
+        return Sim
+    elif model == "events":
+        from events import EventSim
+        return EventSim
+    else:
+        raise ValueError("Unknown model: %s" % model)
+
+
+def available_pieces(conf, peer_pieces, peer_id, files=None):
+    """
+    Return a list of piece ids that this peer has available.  files: the
+    files it shares, with --files; it has nothing of the others.
+    """
+    pieces = range(conf.num_pieces)
+    if files is not None:
+        n = conf.file_pieces
+        pieces = [i for f in files for i in xrange(f * n, (f + 1) * n)]
+    return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
+                  pieces)
+
+
+def save_checkpoint(state, path):
+    """
+    Pickle state, with the current global random state, to path.  Written
+    to a temporary file first and renamed into place, so a run killed
+    while saving leaves the previous checkpoint intact.
+    """
+    state.random_state = random.getstate()
+    tmp = path + ".tmp"
+    f = open(tmp, "wb")
+    try:
+        cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+def load_checkpoint(path):
+    """Load a SimState saved by save_checkpoint, and restore the global
+    random state it was saved with."""
+    f = open(path, "rb")
+    try:
+        state = cPickle.load(f)
+    finally:
+        f.close()
+    random.setstate(state.random_state)
+    return state
+
+
+def run_iteration(args):
+    """
+    Run a single iteration in a worker process.  Lives at module level so
+    multiprocessing can pickle it.
+    args: (config, seed, trace_path, checkpoint_path)
+    Returns (history, the iteration's timers or None).
+    """
+    config, seed, trace_path, checkpoint_path = args
+    sim = sim_class(config.model)(config)
+    history = sim.run_sim_once(seed, trace_path, checkpoint_path)
+    return (history, sim.timers)
 
 
 def configure_logging(loglevel):
@@ -429,27 +893,40 @@ def parse_agents(args):
 
 
 
-def main(args):
-    usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
+def make_parser(usage_msg):
+    """The command line options for a run.  sweep.py builds on these."""
     parser = OptionParser(usage=usage_msg)
 
-    def usage(msg):
-        print "Error: %s\n" % msg
-        parser.print_help()
-        sys.exit()
-
     parser.add_option("--loglevel",
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
 
+    parser.add_option("--quiet",
+                      dest="quiet", default=False, action="store_true",
+                      help="Bench mode: only log the summary stats, and skip "
+                      "all per-round formatting.  Overrides --loglevel")
+
     parser.add_option("--num-pieces",
                       dest="num_pieces", default=16, type="int",
-                      help="Set number of pieces in the file")
+                      help="Set number of pieces in the file (in each file, "
+                      "with --files)")
 
     parser.add_option("--blocks-per-piece",
                       dest="blocks_per_piece", default=16, type="int",
                       help="Set number of blocks per piece")
 
+    parser.add_option("--files",
+                      dest="files", default=1, type="int",
+                      help="Number of files shared in the swarm at once.  "
+                      "Seeds have them all; peers share their upload "
+                      "bandwidth between the files they share")
+
+    parser.add_option("--files-per-peer",
+                      dest="files_per_peer", default=None, type="int",
+                      help="With --files, each peer other than the Seeds "
+                      "shares this many of the files, picked at random "
+                      "(default all)")
+
     parser.add_option("--max-round",
                       dest="max_round", default=200, type="int",
                       help="Limit on number of rounds")
@@ -462,10 +939,193 @@ def main(args):
                       dest="max_up_bw", default=32, type="int",
                       help="Max upload bandwidth")
 
+    parser.add_option("--stall-rounds",
+                      dest="stall_rounds", default=None, type="int",
+                      help="Stop early if nothing is downloaded for this "
+                      "many rounds in a row")
+
     parser.add_option("--iters",
                       dest="iters", default=5, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--history-window",
+                      dest="history_window", default=None, type="int",
+                      help="Only keep the last K rounds of history (at least "
+                      "%d).  Agents can't look back further than that: "
+                      "reading an older round raises IndexError"
+                      % MIN_HISTORY_WINDOW)
+
+    parser.add_option("--trace",
+                      dest="trace", default=None,
+                      help="Stream each iteration's history to this file "
+                      "as it runs (FILE.N.ext per iteration if --iters > 1)")
+
+    parser.add_option("--trace-format",
+                      dest="trace_format", default="binary",
+                      help="Trace file format: 'binary' or 'jsonl'")
+
+    parser.add_option("--checkpoint",
+                      dest="checkpoint", default=None,
+                      help="Save each iteration's state to this file as it "
+                      "runs (FILE.N.ext per iteration if --iters > 1)")
+
+    parser.add_option("--checkpoint-every",
+                      dest="checkpoint_every", default=100, type="int",
+                      help="Rounds between checkpoints (default 100)")
+
+    parser.add_option("--resume",
+                      dest="resume", default=False, action="store_true",
+                      help="Carry on from the --checkpoint files that exist "
+                      "instead of starting those iterations over.  Give the "
+                      "same options and --seed as the interrupted run")
+
+    parser.add_option("--timing",
+                      dest="timing", default=False, action="store_true",
+                      help="Time each phase of the rounds, and each agent "
+                      "class's requests and uploads, and print a table")
+
+    parser.add_option("--validate",
+                      dest="validate", default="full",
+                      help="Checking of agents' requests and uploads: 'full' "
+                      "(every peer, every round), 'sampled' (a random "
+                      "--validate-fraction of them) or 'off' (trusted agents "
+                      "only)")
+
+    parser.add_option("--validate-fraction",
+                      dest="validate_fraction", default=0.1, type="float",
+                      help="Fraction of peers checked each round with "
+                      "--validate sampled (default 0.1)")
+
+    parser.add_option("--neighbors",
+                      dest="neighbors", default=None, type="int",
+                      help="Show each peer only K random neighbors, as a "
+                      "tracker would, instead of the whole swarm")
+
+    parser.add_option("--neighbor-refresh",
+                      dest="neighbor_refresh", default=10, type="int",
+                      help="With --neighbors, rounds between redrawing the "
+                      "neighborhoods (default 10)")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to run iterations in")
+
+    parser.add_option("--model",
+                      dest="model", default="rounds",
+                      help="'rounds' (lock-step, the default) or 'events': "
+                      "peers act on their own schedules, and transfers take "
+                      "time to arrive")
+
+    parser.add_option("--period-spread",
+                      dest="period_spread", default=0.2, type="float",
+                      help="With --model events, each peer's round length "
+                      "is drawn from 1 +/- this (default 0.2)")
+
+    parser.add_option("--max-latency",
+                      dest="max_latency", default=0.1, type="float",
+                      help="With --model events, each link's latency is "
+                      "drawn from 0 to this many rounds (default 0.1)")
+
+    parser.add_option("--engine",
+                      dest="engine", default="python",
+                      help="Simulation core: 'python' or 'numpy' (needs numpy)")
+
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Master random seed.  Each iteration, and each "
+                      "peer in it, gets its own random stream derived from it")
+
+    return parser
+
+
+def check_options(options):
+    """Raise ValueError (or ImportError) if these options can't be run."""
+    block_table_class(options.engine)
+    sim_class(options.model)
+    if not 0 <= options.period_spread < 1:
+        raise ValueError("--period-spread must be at least 0 and below 1")
+    if options.max_latency < 0:
+        raise ValueError("--max-latency can't be negative")
+    if options.trace_format not in ("binary", "jsonl"):
+        raise ValueError("Unknown trace format: %s" % options.trace_format)
+    if options.validate not in ("full", "sampled", "off"):
+        raise ValueError("Unknown validation mode: %s" % options.validate)
+    if not 0 <= options.validate_fraction <= 1:
+        raise ValueError("--validate-fraction must be between 0 and 1")
+    if options.files < 1:
+        raise ValueError("--files must be at least 1")
+    if options.files_per_peer is not None and options.files_per_peer < 1:
+        raise ValueError("--files-per-peer must be at least 1")
+    if options.stall_rounds is not None and options.stall_rounds < 1:
+        raise ValueError("--stall-rounds must be at least 1")
+    if (options.history_window is not None and
+        options.history_window < MIN_HISTORY_WINDOW):
+        raise ValueError("--history-window must be at least %d"
+                         % MIN_HISTORY_WINDOW)
+    if options.neighbors is not None and options.neighbors < 1:
+        raise ValueError("--neighbors must be at least 1")
+    if options.neighbor_refresh < 1:
+        raise ValueError("--neighbor-refresh must be at least 1")
+    if options.checkpoint_every < 1:
+        raise ValueError("--checkpoint-every must be at least 1")
+    if options.resume and options.checkpoint is None:
+        raise ValueError("--resume needs --checkpoint")
+
+
+def make_config(options, agents_to_run, agent_classes=None):
+    """
+    Build the config for a run from parsed options and the list of agent
+    class names.  agent_classes is a dict class_name -> class of classes
+    that are already loaded; by default they're loaded here.
+    """
+    config = Params()
+
+    config.add("agent_class_names", agents_to_run)
+    if agent_classes is None:
+        agent_classes = load_modules(agents_to_run)
+    config.add("agent_classes", agent_classes)
+
+
+    # Files are laid end to end: file f has pieces f * file_pieces up to
+    # (f + 1) * file_pieces, and num_pieces counts them all.
+    config.add("files", options.files)
+    config.add("files_per_peer", options.files_per_peer)
+    config.add("file_pieces", options.num_pieces)
+    config.add("num_pieces", options.num_pieces * options.files)
+    config.add("blocks_per_piece",options.blocks_per_piece)
+    config.add("max_round", options.max_round)
+    config.add("stall_rounds", options.stall_rounds)
+    config.add("min_up_bw", options.min_up_bw)
+    config.add("max_up_bw", options.max_up_bw)
+    config.add("iters", options.iters)
+    config.add("workers", options.workers)
+    config.add("seed", options.seed)
+    config.add("engine", options.engine)
+    config.add("model", options.model)
+    config.add("period_spread", options.period_spread)
+    config.add("max_latency", options.max_latency)
+    config.add("neighbors", options.neighbors)
+    config.add("neighbor_refresh", options.neighbor_refresh)
+    config.add("history_window", options.history_window)
+    config.add("trace", options.trace)
+    config.add("trace_format", options.trace_format)
+    config.add("checkpoint", options.checkpoint)
+    config.add("checkpoint_every", options.checkpoint_every)
+    config.add("resume", options.resume)
+    config.add("timing", options.timing)
+    config.add("validate", options.validate)
+    config.add("validate_fraction", options.validate_fraction)
+    return config
+
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
+    parser = make_parser(usage_msg)
+
+    def usage(msg):
+        print "Error: %s\n" % msg
+        parser.print_help()
+        sys.exit()
 
     (options, args) = parser.parse_args()
 
@@ -482,21 +1142,17 @@ def main(args):
         except ValueError, e:
             usage(e)
 
-    configure_logging(options.loglevel)
-    config = Params()
-
-    config.add("agent_class_names", agents_to_run)
-    config.add("agent_classes", load_modules(config.agent_class_names))
-
+    try:
+        check_options(options)
+    except (ValueError, ImportError), e:
+        usage(e)
 
-    config.add("num_pieces", options.num_pieces)
-    config.add("blocks_per_piece",options.blocks_per_piece)
-    config.add("max_round", options.max_round)
-    config.add("min_up_bw", options.min_up_bw)
-    config.add("max_up_bw", options.max_up_bw)
-    config.add("iters", options.iters)
+    if options.quiet:
+        options.loglevel = "warning"
+    configure_logging(options.loglevel)
+    config = make_config(options, agents_to_run)
 
-    sim = Sim(config)
+    sim = sim_class(config.model)(config)
     sim.run_sim()
 
 if __name__ == "__main__":
@@ -11,11 +11,11 @@ class Stats:
         dict: peer_id -> total upload blocks used
         """
         uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
+        sums = history.download_log.sum_by("from_id", "blocks")
+        for (from_id, blocks) in sums.items():
+            if blocks:
+                uploaded[from_id] += blocks
+
         return uploaded
 
     @staticmethod
@@ -54,3 +54,37 @@ class Stats:
             return None
         return max(d.values())
     
+
+    @staticmethod
+    def file_completion_rounds(history):
+        """With --files: dict : file -> dict : peer_id -> round it finished
+        downloading the file.  Peers that started with a file, or never
+        finished it, aren't in its dict."""
+        d = dict()
+        for ((peer_id, f), r) in history.file_done.items():
+            d.setdefault(f, dict())[peer_id] = r
+        return d
+
+    @staticmethod
+    def file_uploaded_blocks(history):
+        """With --files: dict : file -> dict : peer_id -> blocks of the file
+        the peer uploaded, for the peers that uploaded any."""
+        d = dict()
+        for ((peer_id, f), blocks) in history.file_uploaded.items():
+            d.setdefault(f, dict())[peer_id] = blocks
+        return d
+
+    @staticmethod
+    def stop_reason(history):
+        """Why the sim stopped: "done", "out_of_time" or "no_downloads"
+        (the last with --stall-rounds)"""
+        return history.stop_reason
+
+    @staticmethod
+    def stop_reasons_str(histories):
+        """ How many of the histories stopped for each reason """
+        counts = dict()
+        for h in histories:
+            r = Stats.stop_reason(h)
+            counts[r] = counts.get(r, 0) + 1
+        return ", ".join("%s: %d" % (r, counts[r]) for r in sorted(counts))
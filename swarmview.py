@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+from itertools import chain, islice
+
+
+class SwarmView(object):
+    """
+    The list of PeerInfos a peer is handed each round: every peer's but its
+    own.  Reads go straight to the tuple shared by the whole swarm, skipping
+    the peer's own entry, so handing one out costs nothing.
+
+    Agents are free to treat it as their own list: the first change (a
+    shuffle, sort, append, ...) copies it into a private list first, so the
+    shared tuple and the other peers' views never see it.
+    """
+    __slots__ = ('shared', 'skip', 'own')
+
+    def __init__(self, shared, skip):
+        self.shared = shared  # tuple of every peer's PeerInfo
+        self.skip = skip      # index in shared of the peer's own
+        self.own = None       # the private copy, once there is one
+
+    def mine(self):
+        """The private copy, made now if need be."""
+        if self.own is None:
+            self.own = list(self.shared)
+            del self.own[self.skip]
+        return self.own
+
+    def __len__(self):
+        if self.own is not None:
+            return len(self.own)
+        return len(self.shared) - 1
+
+    def __getitem__(self, i):
+        if self.own is not None:
+            return self.own[i]
+        if isinstance(i, slice):
+            return self.mine()[i]
+        n = len(self.shared) - 1
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("list index out of range")
+        if i >= self.skip:
+            i += 1
+        return self.shared[i]
+
+    def __iter__(self):
+        if self.own is not None:
+            return iter(self.own)
+        (shared, skip) = (self.shared, self.skip)
+        return chain(islice(shared, skip), islice(shared, skip + 1, None))
+
+    def __contains__(self, x):
+        return x in iter(self)
+
+    def __eq__(self, other):
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return list(self) + other
+
+    def __radd__(self, other):
+        return other + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def index(self, x):
+        return list(self).index(x)
+
+    def count(self, x):
+        return list(self).count(x)
+
+    # Anything that changes the list changes the private copy.
+    def __setitem__(self, i, x):
+        self.mine()[i] = x
+
+    def __delitem__(self, i):
+        del self.mine()[i]
+
+    def __iadd__(self, other):
+        self.mine().extend(other)
+        return self
+
+    def append(self, x):
+        self.mine().append(x)
+
+    def extend(self, xs):
+        self.mine().extend(xs)
+
+    def insert(self, i, x):
+        self.mine().insert(i, x)
+
+    def pop(self, i=-1):
+        return self.mine().pop(i)
+
+    def remove(self, x):
+        self.mine().remove(x)
+
+    def reverse(self):
+        self.mine().reverse()
+
+    def sort(self, *args, **kwargs):
+        self.mine().sort(*args, **kwargs)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+Runs a sweep over sim.py's options in one process pool, instead of
+re-launching sim.py for every point.
+
+Every option that takes a number can take a comma separated list, and
+--agents (which can be repeated) gives an agent mix in sim.py's
+PeerClass[,count] syntax.  The sweep runs every combination, for --iters
+iterations each, and writes a CSV table with one row per config x
+iteration x peer:
+
+  sweep.py --num-pieces 16,64 --max-bw 32,64 --iters 10 --workers 8 \\
+      --agents "Lfslstd,8 Seed,2" --agents "Lfslpropshare,8 Seed,2" \\
+      --seed 1 --out results.csv
+
+Give the sweep a --seed to make it reproducible: each point's iterations
+then get the same seeds sim.py would give that config.
+
+Agent classes are loaded once, up front, and shared by all the points.
+"""
+
+import copy
+import csv
+import itertools
+import logging
+import multiprocessing
+import sys
+
+from util import load_modules
+from stats import Stats
+import sim
+
+# Options that can be swept.  dest -> option string
+GRID_OPTIONS = [("num_pieces", "--num-pieces"),
+                ("blocks_per_piece", "--blocks-per-piece"),
+                ("max_round", "--max-round"),
+                ("min_up_bw", "--min-bw"),
+                ("max_up_bw", "--max-bw")]
+
+COLUMNS = (["config", "agents"] + [dest for (dest, opt) in GRID_OPTIONS] +
+           ["iteration", "seed", "peer_id", "agent_class", "up_bw",
+            "uploaded_blocks", "completion_round", "all_done_round",
+            "stop_round", "stop_reason"])
+
+
+def make_configs(options, mixes, agent_classes):
+    """
+    Return [(labels, config)] for every point of the grid.
+    options: sim options, with a list of values for each grid option
+    mixes: [(label, [agent class names])]
+    labels: dict : column -> value, describing the point
+    """
+    grid = [getattr(options, dest) for (dest, opt) in GRID_OPTIONS]
+    configs = []
+    for (label, names) in mixes:
+        for values in itertools.product(*grid):
+            point = copy.copy(options)
+            labels = {"agents": label}
+            for ((dest, opt), v) in zip(GRID_OPTIONS, values):
+                setattr(point, dest, v)
+                labels[dest] = v
+            configs.append((labels, sim.make_config(point, names,
+                                                    agent_classes)))
+    return configs
+
+
+def run_point(args):
+    """
+    Run one iteration of one config, and return its rows: one per peer,
+    with the point's labels, the peer's class and bandwidth, and how it did.
+    args: (config number, labels, config, iteration, seed)
+    """
+    (n, labels, config, i, seed) = args
+    history = sim.sim_class(config.model)(config).run_sim_once(seed)
+    pids = history.peer_ids
+    uploaded = Stats.uploaded_blocks(pids, history)
+    completion = Stats.completion_rounds(pids, history)
+    all_done = Stats.all_done_round(pids, history)
+    rows = []
+    # Peers are created in agent_class_names order.
+    for (pid, class_name) in zip(pids, config.agent_class_names):
+        row = dict(labels)
+        row.update(config=n, iteration=i, seed=seed, peer_id=pid,
+                   agent_class=class_name,
+                   up_bw=history.upload_rates[pid],
+                   uploaded_blocks=uploaded[pid],
+                   completion_round=completion[pid],
+                   all_done_round=all_done,
+                   stop_round=history.stop_round,
+                   stop_reason=Stats.stop_reason(history))
+        rows.append(row)
+    return rows
+
+
+def run_sweep(configs, workers, out):
+    """
+    configs: [(labels, config)], as from make_configs.  Each config's
+    iterations get the same seeds sim.py would use for it.
+    Writes the table to the file out.
+    """
+    jobs = []
+    for (n, (labels, config)) in enumerate(configs):
+        seeds = sim.Sim(config).iteration_seeds()
+        jobs.extend((n, labels, config, i, s) for (i, s) in enumerate(seeds))
+
+    writer = csv.DictWriter(out, COLUMNS)
+    writer.writeheader()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for rows in pool.imap(run_point, jobs):
+                writer.writerows(rows)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for rows in itertools.imap(run_point, jobs):
+            writer.writerows(rows)
+
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] --agents MIX [--agents MIX ...]"
+    parser = sim.make_parser(usage_msg)
+
+    def usage(msg):
+        print "Error: %s\n" % msg
+        parser.print_help()
+        sys.exit()
+
+    for (dest, opt) in GRID_OPTIONS:
+        default = parser.defaults[dest]
+        help = parser.get_option(opt).help
+        parser.remove_option(opt)
+        parser.add_option(opt, dest=dest, default=str(default),
+                          help=help + " (comma separated list to sweep)")
+
+    parser.add_option("--agents",
+                      dest="agents", default=[], action="append",
+                      help="An agent mix, e.g. 'Lfslstd,8 Seed,2'.  "
+                      "Repeat to sweep over mixes")
+
+    parser.add_option("--out",
+                      dest="out", default="sweep.csv",
+                      help="Where to write the results table (default "
+                      "sweep.csv).  Agents print to stdout, so it's best "
+                      "not to send the table there")
+
+    # Points aren't traced, checkpointed or timed.
+    for opt in ["--trace", "--trace-format", "--checkpoint",
+                "--checkpoint-every", "--resume", "--timing"]:
+        parser.remove_option(opt)
+
+    parser.set_defaults(loglevel="warning")
+    (options, args) = parser.parse_args()
+
+    if len(options.agents) == 0:
+        usage("Need at least one --agents mix")
+    try:
+        mixes = [(a, sim.parse_agents(a.split())) for a in options.agents]
+        for (dest, opt) in GRID_OPTIONS:
+            setattr(options, dest,
+                    [int(v) for v in getattr(options, dest).split(',')])
+        sim.check_options(options)
+    except (ValueError, ImportError), e:
+        usage(e)
+
+    if options.quiet:
+        options.loglevel = "warning"
+    sim.configure_logging(options.loglevel)
+
+    names = set(itertools.chain(*[names for (label, names) in mixes]))
+    agent_classes = load_modules(names)
+    configs = make_configs(options, mixes, agent_classes)
+    logging.warning("Sweeping %d configs x %d iterations",
+                    len(configs), options.iters)
+
+    # Points run one iteration each, so --workers goes to the sweep.
+    workers = options.workers
+    for (labels, config) in configs:
+        config.add("workers", 1)
+
+    out = open(options.out, "wb")
+    try:
+        run_sweep(configs, workers, out)
+    finally:
+        out.close()
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+"""
+Cumulative timers for the phases of the sim's rounds, turned on with
+--timing.  The sim laps a Timers object at the end of each phase:
+
+    mark = timers.now()
+    ... phase ...
+    mark = timers.lap("transfer", mark)
+
+and leaves it out entirely (sim.timers is None) when timing is off, so
+the only cost then is a test per phase.
+"""
+
+from timeit import default_timer
+
+
+class Timers:
+    """
+    seconds, calls: dict : key -> total seconds, number of laps
+    Keys are phase names, or (phase, agent class name) for the phases that
+    run agent code.
+    """
+    # The phases of a round, in order.
+    PHASES = ["peer_info", "requests", "check_requests", "route", "uploads",
+              "check_uploads", "transfer", "history", "logging", "done"]
+
+    def __init__(self):
+        self.seconds = dict()
+        self.calls = dict()
+
+    def now(self):
+        return default_timer()
+
+    def lap(self, key, since):
+        """Add the time since since to key, and return the time now."""
+        now = default_timer()
+        self.seconds[key] = self.seconds.get(key, 0.0) + (now - since)
+        self.calls[key] = self.calls.get(key, 0) + 1
+        return now
+
+    def merge(self, other):
+        """Add other's times into these, e.g. from another iteration."""
+        for (key, s) in other.seconds.items():
+            self.seconds[key] = self.seconds.get(key, 0.0) + s
+            self.calls[key] = self.calls.get(key, 0) + other.calls[key]
+
+    def phases(self):
+        """dict : phase -> (seconds, calls), over all agent classes."""
+        totals = dict()
+        for (key, s) in self.seconds.items():
+            phase = key[0] if isinstance(key, tuple) else key
+            (seconds, calls) = totals.get(phase, (0.0, 0))
+            totals[phase] = (seconds + s, calls + self.calls[key])
+        return totals
+
+    def agents(self):
+        """dict : agent class name -> phase -> (seconds, calls)"""
+        by_class = dict()
+        for (key, s) in self.seconds.items():
+            if isinstance(key, tuple):
+                (phase, class_name) = key
+                by_class.setdefault(class_name, dict())[phase] = (
+                    s, self.calls[key])
+        return by_class
+
+    def as_dict(self):
+        """The timers as plain dicts and numbers, e.g. for json."""
+        def entry((seconds, calls)):
+            return {"seconds": seconds, "calls": calls}
+        return {"phases": dict((phase, entry(v))
+                               for (phase, v) in self.phases().items()),
+                "agents": dict((name, dict((phase, entry(v))
+                                           for (phase, v) in ps.items()))
+                               for (name, ps) in self.agents().items())}
+
+    def table(self):
+        """A summary table, phases first and then agent classes."""
+        phases = self.phases()
+        total = sum(s for (s, calls) in phases.values()) or 1.0
+        lines = ["%-28s %10s %6s %10s %12s" % (
+            "phase", "seconds", "%", "calls", "usec/call")]
+
+        def line(name, (seconds, calls)):
+            lines.append("%-28s %10.3f %5.1f%% %10d %12.1f" % (
+                name, seconds, 100 * seconds / total, calls,
+                1e6 * seconds / max(calls, 1)))
+
+        for phase in self.PHASES:
+            if phase in phases:
+                line(phase, phases[phase])
+        agents = self.agents()
+        for name in sorted(agents):
+            for phase in self.PHASES:
+                if phase in agents[name]:
+                    line("%s %s" % (name, phase), agents[name][phase])
+        return "\n".join(lines)
@@ -0,0 +1,324 @@
+#!/usr/bin/python
+
+"""
+Streaming history traces.  A sink gets each round's downloads and uploads
+as the History records them and writes them straight to a file, so the
+full history of a long run can be kept without holding it in memory.
+TraceReader reads a trace back one round at a time.
+
+Two formats:
+  binary: a JSON header, then tagged little-endian records.  Peer ids
+          are referred to by their index in the header's peer_ids, plus
+          any new ids the trace introduces along the way.
+  jsonl:  one JSON object per line.  Bigger, but easy to poke at.
+"""
+
+import json
+import struct
+
+from messages import Download, Upload
+from history import History
+
+MAGIC = "LFSLTRC1"
+
+# Binary records.  Each starts with a one byte tag.
+NEW_ID = "N"     # <I length, then the id: gets the next index
+ROUND = "R"      # <iII round, downloads, uploads; then the messages
+DONE = "D"       # <Ii peer index, round
+STOP = "S"       # <iI round, length; then why the sim stopped
+FILE_DONE = "F"  # <IIi peer index, file, round (with --files)
+ROUND_HEADER = struct.Struct("<iII")
+DOWNLOAD = struct.Struct("<IIId")   # from, to, piece, blocks
+UPLOAD = struct.Struct("<IId")      # from, to, bw
+DONE_RECORD = struct.Struct("<Ii")
+STOP_RECORD = struct.Struct("<iI")
+FILE_DONE_RECORD = struct.Struct("<IIi")
+LENGTH = struct.Struct("<I")
+
+
+class HistorySink:
+    """
+    Where a History sends what it records, as it records it.  Subclass
+    this to send history somewhere else.
+    """
+    def start(self, peer_ids, upload_rates, file_pieces=None):
+        pass
+
+    def write_round(self, round, dls, ups):
+        """
+        dls: dict : peer_id -> [downloads to that peer] for this round
+        ups: dict : peer_id -> [uploads from that peer] for this round
+        """
+        pass
+
+    def write_done(self, peer_id, round):
+        pass
+
+    def write_file_done(self, peer_id, file, round):
+        pass
+
+    def write_stop(self, round, reason):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink(HistorySink):
+    """
+    A sink that writes to a file.  It can be pickled along with the rest of
+    a checkpointed run: it remembers how much of the file had been written,
+    and when it's unpickled it reopens the file and cuts off anything
+    written after that, so a resumed run carries on where the checkpoint
+    left off.
+    """
+    mode = "wb"
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, self.mode)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        self.f.flush()
+        state["f"] = self.f.tell()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        pos = state["f"]
+        self.f = open(self.path, "r+b")
+        self.f.truncate(pos)
+        self.f.seek(pos)
+
+    def close(self):
+        self.f.close()
+
+
+class BinarySink(FileSink):
+    def __init__(self, path):
+        FileSink.__init__(self, path)
+        self.index = dict()
+
+    def id_index(self, pid):
+        if pid not in self.index:
+            self.index[pid] = len(self.index)
+            s = str(pid)
+            self.f.write(NEW_ID + LENGTH.pack(len(s)) + s)
+        return self.index[pid]
+
+    def start(self, peer_ids, upload_rates, file_pieces=None):
+        header = json.dumps(make_header(peer_ids, upload_rates, file_pieces))
+        self.f.write(MAGIC + LENGTH.pack(len(header)) + header)
+        for pid in peer_ids:
+            self.index[pid] = len(self.index)
+
+    def write_round(self, round, dls, ups):
+        # Ids have to be written before the round that uses them.
+        idx = self.id_index
+        ds = [DOWNLOAD.pack(idx(d.from_id), idx(d.to_id), d.piece, d.blocks)
+              for pid in sorted(dls, key=idx) for d in dls[pid]]
+        us = [UPLOAD.pack(idx(u.from_id), idx(u.to_id), u.bw)
+              for pid in sorted(ups, key=idx) for u in ups[pid]]
+        self.f.write(ROUND + ROUND_HEADER.pack(round, len(ds), len(us)))
+        self.f.write("".join(ds))
+        self.f.write("".join(us))
+
+    def write_done(self, peer_id, round):
+        self.f.write(DONE + DONE_RECORD.pack(self.id_index(peer_id), round))
+
+    def write_file_done(self, peer_id, file, round):
+        self.f.write(FILE_DONE + FILE_DONE_RECORD.pack(self.id_index(peer_id),
+                                                       file, round))
+
+    def write_stop(self, round, reason):
+        self.f.write(STOP + STOP_RECORD.pack(round, len(reason)) + reason)
+
+
+class JsonlSink(FileSink):
+    mode = "w"
+
+    def __init__(self, path):
+        FileSink.__init__(self, path)
+        self.peer_ids = []
+
+    def write(self, obj):
+        self.f.write(json.dumps(obj, separators=(',', ':')))
+        self.f.write("\n")
+
+    def start(self, peer_ids, upload_rates, file_pieces=None):
+        self.peer_ids = peer_ids[:]
+        self.write(make_header(peer_ids, upload_rates, file_pieces))
+
+    def write_round(self, round, dls, ups):
+        self.write({
+            "round": round,
+            "downloads": [[d.from_id, d.to_id, d.piece, d.blocks]
+                          for pid in self.peer_ids for d in dls[pid]],
+            "uploads": [[u.from_id, u.to_id, u.bw]
+                        for pid in self.peer_ids for u in ups[pid]]})
+
+    def write_done(self, peer_id, round):
+        self.write({"done": peer_id, "round": round})
+
+    def write_file_done(self, peer_id, file, round):
+        self.write({"file_done": file, "peer": peer_id, "round": round})
+
+    def write_stop(self, round, reason):
+        self.write({"stop": reason, "round": round})
+
+
+def make_header(peer_ids, upload_rates, file_pieces):
+    header = {"peer_ids": peer_ids, "upload_rates": upload_rates}
+    if file_pieces is not None:
+        header["file_pieces"] = file_pieces
+    return header
+
+
+def open_sink(path, format="binary"):
+    if format == "binary":
+        return BinarySink(path)
+    elif format == "jsonl":
+        return JsonlSink(path)
+    else:
+        raise ValueError("Unknown trace format: %s" % format)
+
+
+class TraceReader:
+    """
+    Reads a trace written by BinarySink or JsonlSink (it can tell which).
+
+    reader.peer_ids, reader.upload_rates: from the header
+    reader.rounds(): iterate over (round, dls, ups), one round at a time,
+        in the same form History.update takes
+    reader.round_done: dict : peer_id -> round finished, filled in as the
+        rounds are read
+    reader.file_pieces, reader.file_done: with --files, the pieces in each
+        file from the header, and dict : (peer_id, file) -> round finished,
+        filled in as the rounds are read
+    reader.stop_round, reader.stop_reason: where and why the sim stopped,
+        once the end of the trace has been read
+    reader.replay(window): rebuild a History from the trace
+    """
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self.binary = f.read(len(MAGIC)) == MAGIC
+        finally:
+            f.close()
+        self.f = None
+        self.ids = []
+        self.read_header()
+
+    def read_header(self):
+        self.round_done = dict()
+        self.file_done = dict()
+        self.stop_round = None
+        self.stop_reason = None
+        if self.f is not None:
+            self.f.close()
+        if self.binary:
+            self.f = open(self.path, "rb")
+            self.f.read(len(MAGIC))
+            (n,) = LENGTH.unpack(self.f.read(LENGTH.size))
+            header = json.loads(self.f.read(n))
+        else:
+            self.f = open(self.path, "r")
+            header = json.loads(self.f.readline())
+        # json gives back unicode; the sim's ids are plain strings.
+        self.peer_ids = [str(pid) for pid in header["peer_ids"]]
+        self.upload_rates = dict((str(pid), bw) for (pid, bw)
+                                 in header["upload_rates"].items())
+        self.file_pieces = header.get("file_pieces")
+        self.ids = self.peer_ids[:]
+
+    def read_id(self):
+        (n,) = LENGTH.unpack(self.f.read(LENGTH.size))
+        self.ids.append(self.f.read(n))
+
+    def rounds(self):
+        self.read_header()
+        if self.binary:
+            return self.binary_rounds()
+        return self.jsonl_rounds()
+
+    def empty_round(self):
+        return (dict((pid, []) for pid in self.peer_ids),
+                dict((pid, []) for pid in self.peer_ids))
+
+    def binary_rounds(self):
+        f = self.f
+        ids = self.ids
+        while True:
+            tag = f.read(1)
+            if tag == "":
+                break
+            elif tag == NEW_ID:
+                self.read_id()
+            elif tag == DONE:
+                (i, r) = DONE_RECORD.unpack(f.read(DONE_RECORD.size))
+                self.round_done[ids[i]] = r
+            elif tag == FILE_DONE:
+                (i, fid, r) = FILE_DONE_RECORD.unpack(
+                    f.read(FILE_DONE_RECORD.size))
+                self.file_done[(ids[i], fid)] = r
+            elif tag == STOP:
+                (r, n) = STOP_RECORD.unpack(f.read(STOP_RECORD.size))
+                self.stop_round = r
+                self.stop_reason = f.read(n)
+            elif tag == ROUND:
+                (r, nd, nu) = ROUND_HEADER.unpack(f.read(ROUND_HEADER.size))
+                (dls, ups) = self.empty_round()
+                data = f.read(nd * DOWNLOAD.size)
+                for k in xrange(nd):
+                    (fr, to, piece, blocks) = DOWNLOAD.unpack_from(
+                        data, k * DOWNLOAD.size)
+                    dls[ids[to]].append(Download(ids[fr], ids[to], piece, blocks))
+                data = f.read(nu * UPLOAD.size)
+                for k in xrange(nu):
+                    (fr, to, bw) = UPLOAD.unpack_from(data, k * UPLOAD.size)
+                    ups[ids[fr]].append(Upload(ids[fr], ids[to], bw))
+                yield (r, dls, ups)
+            else:
+                raise ValueError("Bad record in trace %s: %r" % (self.path, tag))
+        f.close()
+
+    def jsonl_rounds(self):
+        for line in self.f:
+            obj = json.loads(line)
+            if "done" in obj:
+                self.round_done[str(obj["done"])] = obj["round"]
+                continue
+            if "file_done" in obj:
+                self.file_done[(str(obj["peer"]), obj["file_done"])] = \
+                    obj["round"]
+                continue
+            if "stop" in obj:
+                self.stop_round = obj["round"]
+                self.stop_reason = str(obj["stop"])
+                continue
+            (dls, ups) = self.empty_round()
+            for (fr, to, piece, blocks) in obj["downloads"]:
+                dls[str(to)].append(Download(str(fr), str(to), piece, blocks))
+            for (fr, to, bw) in obj["uploads"]:
+                ups[str(fr)].append(Upload(str(fr), str(to), bw))
+            yield (obj["round"], dls, ups)
+        self.f.close()
+
+    def replay(self, window=None):
+        """
+        Rebuild the run's History from the trace.  With a window, only the
+        last window rounds are kept in memory, as in the sim.
+        """
+        history = History(self.peer_ids, self.upload_rates, window,
+                          file_pieces=self.file_pieces)
+        for (r, dls, ups) in self.rounds():
+            history.update(dls, ups)
+        for (pid, r) in self.round_done.items():
+            history.peer_is_done(r, pid)
+        for ((pid, fid), r) in self.file_done.items():
+            history.peer_finished_file(r, pid, fid)
+        if self.stop_reason is not None:
+            history.stopped(self.stop_round, self.stop_reason)
+        return history
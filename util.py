@@ -5,6 +5,7 @@
 # http://stackoverflow.com/questions/5098580/implementing-argmax-in-python
 
 from itertools import imap, izip, count
+import hashlib
 import math
 
 
@@ -86,6 +87,68 @@ def even_split(n, k):
     return ans
 
 
+def derive_seed(seed, *keys):
+    """
+    Derive a seed for an independent random stream from seed and some keys
+    (an iteration number, a peer id, ...).  The same seed and keys always
+    give the same result, whatever else has been derived or drawn.
+
+    >>> derive_seed(1, "up_bw", "Seed0") == derive_seed(1, "up_bw", "Seed0")
+    True
+    """
+    return int(hashlib.md5(repr((seed,) + keys)).hexdigest()[:16], 16)
+
+
+def random_neighbors(n, k, rng):
+    """
+    A random neighbor graph over n peers, numbered 0 to n-1, like the one a
+    tracker builds up: links go both ways, and no peer gets more than k
+    neighbors (nearly all get exactly k, if n > k).  rng is a
+    random.Random.  Returns a list: peer -> sorted list of its neighbors.
+
+    >>> import random
+    >>> g = random_neighbors(10, 3, random.Random(1))
+    >>> max(len(ns) for ns in g)
+    3
+    >>> all(i in g[j] for i in range(10) for j in g[i])
+    True
+    """
+    k = min(k, n - 1)
+    adj = [set() for i in xrange(n)]
+    # The peers with room for more neighbors, and where each one is in it.
+    room = range(n)
+    where = range(n)
+
+    def full(i):
+        j = room.pop()
+        if j != i:
+            room[where[i]] = j
+            where[j] = where[i]
+        where[i] = None
+
+    order = range(n)
+    rng.shuffle(order)
+    for i in order:
+        if where[i] is None:
+            continue  # already full
+        misses = 0
+        # Give up after a few draws of peers i is already linked to, so
+        # the last few peers can't loop forever.  Peers left short stay
+        # in room, for the peers after them to link to.
+        while len(adj[i]) < k and len(room) > 1 and misses <= k:
+            j = room[rng.randrange(len(room))]
+            if j == i or j in adj[i]:
+                misses += 1
+                continue
+            adj[i].add(j)
+            adj[j].add(i)
+            if len(adj[j]) == k:
+                full(j)
+        if len(adj[i]) == k:
+            full(i)
+    return [sorted(ns) for ns in adj]
+
+
 def load_modules(agent_classes):
     """Each agent class must be in module class_name.lower().
     Returns a dictionary class_name->class"""